@@ -1,5 +1,6 @@
 """Generate virtual closed-cell or open-cell foam structure."""
 
+from . import artifacts
 from . import generation
 from . import geo_tools
 from . import morphology
@@ -10,6 +11,7 @@ from . import umesh
 from . import vtk_tools
 
 __all__ = [
+    'artifacts',
     'generation',
     'geo_tools',
     'morphology',
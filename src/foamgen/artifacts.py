@@ -0,0 +1,74 @@
+"""
+Artifacts module
+================
+:synopsis: Deferred rendering of diagnostic artifacts.
+
+Plots and pictures (size distribution histograms, packing and tessellation
+previews) are not needed by the following stages of foam generation. They are
+queued and rendered one by one in a background worker, so that the geometry
+pipeline does not wait for them. In batch mode, they are skipped altogether.
+"""
+from __future__ import print_function
+from concurrent.futures import ThreadPoolExecutor
+# queue state, worker is started with the first artifact
+STATE = {'enabled': True, 'worker': None, 'pending': []}
+
+
+def configure(enabled):
+    """Switch rendering of artifacts on or off.
+
+    Args:
+        enabled (bool): render artifacts if True, skip them otherwise
+    """
+    STATE['enabled'] = enabled
+
+
+def submit(func, *args, **kwargs):
+    """Queue rendering of an artifact.
+
+    Args:
+        func (callable): function creating the artifact
+        *args: positional arguments of ``func``
+        **kwargs: keyword arguments of ``func``
+
+    Returns:
+        Future: queued task, None if artifacts are switched off
+    """
+    if not STATE['enabled']:
+        return None
+    if STATE['worker'] is None:
+        STATE['worker'] = ThreadPoolExecutor(max_workers=1)
+    future = STATE['worker'].submit(func, *args, **kwargs)
+    STATE['pending'].append(future)
+    return future
+
+
+def run_after(func, *args, **kwargs):
+    """Run function after all queued artifacts are rendered.
+
+    Useful for clean-up of files needed by queued artifacts. Function is
+    called immediately, if nothing is queued.
+
+    Args:
+        func (callable): function to be called
+        *args: positional arguments of ``func``
+        **kwargs: keyword arguments of ``func``
+    """
+    if any(not future.done() for future in STATE['pending']):
+        future = STATE['worker'].submit(func, *args, **kwargs)
+        STATE['pending'].append(future)
+    else:
+        func(*args, **kwargs)
+
+
+def wait():
+    """Wait until all queued artifacts are rendered.
+
+    Failures of rendering are reported, but not raised, because artifacts are
+    only diagnostic.
+    """
+    pending, STATE['pending'] = STATE['pending'], []
+    for future in pending:
+        exc = future.exception()
+        if exc is not None:
+            print('Rendering of artifact failed: {}'.format(exc))
@@ -27,6 +27,7 @@ int main(int argc,char *argv[])
 	int ***amat,***smat; // 3D matrix of voxels
     int *center_x, *center_y, *center_z; // position of seeds
 	int vmax=10000; // maximum number of vertices
+	int nvert; // number of vertices of binary skeleton
 	int incmax=8; // maximum number of incident vertices to a vertex
 	double **vert; // vertex coordinates
 	int **vinc; // incident vertices for each vertex
@@ -99,6 +100,11 @@ int main(int argc,char *argv[])
 			makeFoamSkeleton(GnuplotSkeletonFilename,ncell,center_x,center_y,\
 				center_z,progress_report);
 		}
+		// binary skeleton knows its number of vertices
+		nvert=binarySkeletonSize(GnuplotSkeletonFilename);
+		if (nvert > 0) {
+			vmax=nvert;
+		}
 		vert=alloc_dmatrix(vmax,3);
 		vinc=alloc_matrix(vmax,incmax);
 		// read the gnuplot diagram with the tessellation
@@ -7,6 +7,8 @@
 #include <iostream>
 #include <fstream>
 #include <sstream>
+#include <vector>
+#include <cstdint>
 #include "voro++.hh"
 #include "geometry.hh"
 using namespace std;
@@ -43,6 +45,119 @@ void makeFoamSkeleton(\
     // Save the Voronoi network of all the particles to text files
     con.draw_cells_gnuplot(filename.c_str());
 }
+//! Check whether skeleton is in binary format and get its number of vertices.
+//!
+//! Returns -1 for other than binary skeletons (files without `.skel`
+//! extension).
+int binarySkeletonSize(\
+    string filename /**< [in] Name of output file with tessellation */)
+{
+    char magic[8];
+    int32_t nv;
+    ifstream fin;
+    if (filename.size() <= 5 || \
+        filename.compare(filename.size()-5,5,".skel") != 0) {
+        return -1;
+    }
+    fin.open(filename, ios::binary);
+    if (!fin.is_open()) {
+        cout << "can't open binary file with foam skeleton" << endl;
+        exit(1);
+    }
+    fin.read(magic,8);
+    fin.read(reinterpret_cast<char *>(&nv),sizeof(nv));
+    if (!fin || string(magic,8) != "FGSKEL01") {
+        cout << "unknown format of binary file with foam skeleton" << endl;
+        exit(1);
+    }
+    return nv;
+}
+//! Load binary skeleton of tessellation and store it.
+//!
+//! Skeleton is written by `foamgen.tessellation.save_skeleton`. Vertices are
+//! already unique and edges already mirrored over the domain. `vert` and
+//! `vinc` are allocated for number of vertices given by `binarySkeletonSize`.
+void importBinarySkeleton(\
+    string filename /**< [in] Name of output file with tessellation */,\
+    double **vert /**< [out] vertex positions */,\
+    int **vinc /**< [out] indexes of connected vertices */,\
+    int vmax /**< [in] maximum number of vertices */,\
+    int incmax /**< [in] maximum number of vertex connections */,\
+    int &sv /**< [out] number of vertices */,\
+    bool report /**< [in] show output */)
+{
+    // Coordinates follow the convention of gnuplot files (axes swapped and
+    // scaled only for imported VTK morphology), see `importFoamSkeleton`.
+    // File layout (little endian): 8 byte magic `FGSKEL01`, number of
+    // vertices and edges (int32), vertex coordinates relative to domain size
+    // (float64, nv x 3), periodic image shifts of vertices (int32, nv x 3),
+    // vertex indices of edges (int32, ne x 2).
+    int i,j,k;
+    char magic[8];
+    int32_t nv,ne;
+    ifstream fin;
+    if (report) {
+        cout << "loading cell vertices and edges" << endl;
+    }
+    fin.open(filename, ios::binary);
+    if (!fin.is_open()) {
+        cout << "can't open binary file with foam skeleton" << endl;
+        exit(1);
+    }
+    fin.read(magic,8);
+    if (string(magic,8) != "FGSKEL01") {
+        cout << "unknown format of binary file with foam skeleton" << endl;
+        exit(1);
+    }
+    fin.read(reinterpret_cast<char *>(&nv),sizeof(nv));
+    fin.read(reinterpret_cast<char *>(&ne),sizeof(ne));
+    if (nv > vmax) {
+        cout << "foam skeleton has too many vertices" << endl;
+        exit(1);
+    }
+    vector<double> xyz(3*nv);
+    vector<int32_t> edges(2*ne);
+    fin.read(reinterpret_cast<char *>(xyz.data()),xyz.size()*sizeof(double));
+    // periodic image shifts are not needed here
+    fin.seekg(3*nv*sizeof(int32_t),ios::cur);
+    fin.read(reinterpret_cast<char *>(edges.data()),\
+        edges.size()*sizeof(int32_t));
+    if (!fin) {
+        cout << "binary file with foam skeleton is truncated" << endl;
+        exit(1);
+    }
+    fin.close();
+    for (i=0; i<vmax; i++) { //initialize vert
+        vert[i][0]=0;
+        vert[i][1]=0;
+        vert[i][2]=0;
+        for (j=0; j<incmax; j++) vinc[i][j]=-1;
+    }
+    for (i=0; i<nv; i++) {
+        if (!import_vtk) {
+            vert[i][0]=xyz[3*i];
+            vert[i][1]=xyz[3*i+1];
+            vert[i][2]=xyz[3*i+2];
+        } else { //axes are swapped as for imported VTK morphology
+            vert[i][0]=xyz[3*i+2]*nx;
+            vert[i][1]=xyz[3*i+1]*ny;
+            vert[i][2]=xyz[3*i]*nz;
+        }
+    }
+    sv=nv;
+    for (k=0; k<ne; k++) {
+        for (j=0; j<2; j++) {
+            //vertex edges[2*k+1-j] is incident to vertex edges[2*k+j]
+            for (i=0; i<incmax; i++) {
+                if (vinc[edges[2*k+j]][i] == edges[2*k+1-j]) break;
+                if (vinc[edges[2*k+j]][i] == -1) {
+                    vinc[edges[2*k+j]][i] = edges[2*k+1-j];
+                    break;
+                }
+            }
+        }
+    }
+}
 //! Load geometric tessellation, move it to the domain and store it.
 void importFoamSkeleton(\
     string filename /**< [in] Name of output file with tessellation */,\
@@ -54,7 +169,7 @@ void importFoamSkeleton(\
     bool report /**< [in] show output */)
 {
     // Imports foam skeleton from gnuplot file. Creates `vert` and `vinc` and
-    // calculates `sv`.
+    // calculates `sv`. Files with `.skel` extension are binary skeletons.
     int i,j;
     double xmin=0,xmax=nx;
     double ymin=0,ymax=ny;
@@ -65,6 +180,11 @@ void importFoamSkeleton(\
     string line;
     bool found;
     double eps=1e-2; //tolerance for close voronoi vertices
+    if (filename.size() > 5 && \
+        filename.compare(filename.size()-5,5,".skel") == 0) {
+        importBinarySkeleton(filename,vert,vinc,vmax,incmax,sv,report);
+        return;
+    }
     if (report) {
         cout << "loading cell vertices and edges" << endl;
     }
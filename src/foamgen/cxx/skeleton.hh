@@ -2,6 +2,9 @@
 #define SKELETON_H
 
 void makeFoamSkeleton(std::string, int, int *, int *, int *, bool);
+int binarySkeletonSize(std::string);
+void importBinarySkeleton(std::string, double **, int **, int, int, int &,
+    bool);
 void importFoamSkeleton(std::string, double **, int **, int, int, int &, bool);
 
 #endif
@@ -13,6 +13,7 @@ import yaml
 import munch
 import jsonargparse as jp
 from blessings import Terminal
+from . import artifacts
 from . import packing
 from . import tessellation
 from . import morphology
@@ -27,6 +28,17 @@ def parse_cli_and_generate():
     <https://omni-us.github.io/jsonargparse/>`_. This function is called by the
     ``foamgen`` executable.
     """
+    prs = create_parser()
+    cfg = prs.parse_args(sys.argv[1:])
+    generate(cfg)
+
+
+def create_parser():
+    """Create parser of CLI arguments.
+
+    Returns:
+        ArgumentParser: parser with all options and their defaults
+    """
     prs = jp.ArgumentParser(
         prog='foamgen',
         error_handler=jp.usage_and_exit_error_handler,
@@ -37,6 +49,8 @@ def parse_cli_and_generate():
                      help='name of config file')
     prs.add_argument('-f', '--filename', default='Foam',
                      help='base filename')
+    prs.add_argument('--no-artifacts', default=False, action='store_true',
+                     help='skip diagnostic plots and pictures (batch mode)')
     prs.add_argument('-p', '--pack.active', default=False,
                      action='store_true', help='create sphere packing')
     prs.add_argument('--pack.ncells', default=27, type=int,
@@ -46,19 +60,64 @@ def parse_cli_and_generate():
     prs.add_argument('--pack.scale', default=0.35, type=float,
                      help='sphere size distribution scale factor')
     prs.add_argument('--pack.alg', default='fba',
-                     help='packing algorithm')
+                     help='packing algorithm (simple, cr, fba, ls, lsgd, '
+                     + 'lsebc, ojt, kjt)')
     prs.add_argument('--pack.render', default=False,
                      action='store_true', help='visualize packing')
     prs.add_argument('--pack.clean', default=True, action='store_true',
                      help='clean redundant files')
     prs.add_argument('--pack.maxit', default=5, type=int,
                      help='maximum number of iterations')
+    prs.add_argument('--pack.nproc', default=1, type=int,
+                     help='number of concurrent iterations (successful '
+                     + 'iteration with the lowest index is used)')
+    prs.add_argument('--pack.init', default=None,
+                     help='previous packing (*Packing.csv or *Packing.npz) '
+                     + 'used as initial configuration')
+    prs.add_argument('--pack.timeout', default=0, type=float,
+                     help='maximum time of one iteration in seconds '
+                     + '(0 means unlimited)')
+    prs.add_argument('--pack.stall', default=0, type=float,
+                     help='maximum time without progress in seconds '
+                     + '(0 means unlimited)')
+    prs.add_argument('--pack.window', default=0, type=int,
+                     help='number of energy records, in which the energy '
+                     + 'must decrease (0 means unlimited)')
+    prs.add_argument('--pack.rtol', default=1e-3, type=float,
+                     help='relative decrease of energy within the window')
+    prs.add_argument('--pack.format', default='csv',
+                     help='file format of packing (csv, npz)')
+    prs.add_argument('--pack.seed', default=None, type=int,
+                     help='seed of random number generator')
+    prs.add_argument('--pack.cache', default=None,
+                     help='cache directory for packings (requires seed)')
+    prs.add_argument('--pack.cachesize', default=1024, type=float,
+                     help='maximum size of packing cache in MB')
     prs.add_argument('-t', '--tess.active', default=False,
                      action='store_true', help='create tessellation')
     prs.add_argument('--tess.render', default=False,
                      action='store_true', help='visualize tessellation')
     prs.add_argument('--tess.clean', default=True, action='store_true',
                      help='clean redundant files')
+    prs.add_argument('--tess.engine', default='neper',
+                     help='tessellation engine (neper, native)')
+    prs.add_argument('--tess.validate', default=True, type=bool,
+                     help='check tessellation before following stages '
+                     + '(true or false)')
+    prs.add_argument('--tess.minedge', default=0, type=float,
+                     help='minimum edge length (0 means 1e-4 of mean cell '
+                     + 'size)')
+    prs.add_argument('--tess.regedge', default=0, type=float,
+                     help='collapse edges shorter than this fraction of mean '
+                     + 'cell size (0 means no regularization)')
+    prs.add_argument('--tess.regface', default=0, type=float,
+                     help='collapse faces smaller than this fraction of '
+                     + 'squared mean cell size (0 means no regularization)')
+    prs.add_argument('--tess.gnuplot', default=False, action='store_true',
+                     help='save tessellation in gnuplot format')
+    prs.add_argument('--tess.repack', default=0, type=int,
+                     help='number of new packings tried, when tessellation '
+                     + 'is not valid (requires packing)')
     prs.add_argument('-m', '--morph.active', default=False,
                      action='store_true', help='create final morphology')
     prs.add_argument('--morph.dwall', default=0.02, type=float,
@@ -88,8 +147,7 @@ def parse_cli_and_generate():
     prs.add_argument('--smesh.perbox', default=True,
                      action='store_true',
                      help='transform structure to periodic box')
-    cfg = prs.parse_args(sys.argv[1:])
-    generate(cfg)
+    return prs
 
 
 def parse_config_file(fname):
@@ -97,6 +155,8 @@ def parse_config_file(fname):
 
     Parsed options can be accessed as arguments of the returned object. For
     more information see `Munch <https://github.com/Infinidat/munch>`_.
+    Options missing in the config file (e.g., in files written for older
+    versions) get their default values, see :func:`create_parser`.
 
     Args:
         fname (str): config filename
@@ -109,7 +169,56 @@ def parse_config_file(fname):
             cfg = yaml.safe_load(stream)
         except yaml.YAMLError as exc:
             print(exc)
-    return munch.munchify(cfg)
+    defaults = create_parser().get_defaults().as_dict()
+    defaults.pop('config', None)
+    return munch.munchify(_merge(defaults, cfg or dict()))
+
+
+def _merge(defaults, values):
+    """Recursively update nested dictionary of defaults with values.
+
+    Args:
+        defaults (dict): default values
+        values (dict): values overriding defaults
+
+    Returns:
+        dict: merged dictionary
+    """
+    merged = dict(defaults)
+    for key, value in values.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def pack(cfg, seed, cache=True):
+    """Call :func:`foamgen.packing.pack_spheres` with parsed inputs.
+
+    Args:
+        cfg (Namespace): parsed inputs
+        seed (int): seed of random number generator
+        cache (bool, optional): use packing cache given by inputs if True
+    """
+    packing.pack_spheres(cfg.filename,
+                         cfg.pack.shape,
+                         cfg.pack.scale,
+                         cfg.pack.ncells,
+                         cfg.pack.alg,
+                         cfg.pack.maxit,
+                         cfg.pack.render,
+                         cfg.pack.clean,
+                         cfg.pack.nproc,
+                         cfg.pack.init,
+                         cfg.pack.timeout,
+                         cfg.pack.stall,
+                         cfg.pack.window,
+                         cfg.pack.rtol,
+                         cfg.pack.format,
+                         seed,
+                         cfg.pack.cache if cache else None,
+                         cfg.pack.cachesize)
 
 
 def generate(cfg):
@@ -124,21 +233,29 @@ def generate(cfg):
     # switch off matplotlib DEBUG messages
     mpl_logger = logging.getLogger('matplotlib')
     mpl_logger.setLevel(logging.WARNING)
+    artifacts.configure(not cfg.no_artifacts)
     if cfg.pack.active:
         print(term.yellow + "Packing spheres." + term.normal)
-        packing.pack_spheres(cfg.filename,
-                             cfg.pack.shape,
-                             cfg.pack.scale,
-                             cfg.pack.ncells,
-                             cfg.pack.alg,
-                             cfg.pack.maxit,
-                             cfg.pack.render,
-                             cfg.pack.clean)
+        pack(cfg, cfg.pack.seed)
     if cfg.tess.active:
         print(term.yellow + "Tessellating." + term.normal)
-        tessellation.tessellate(cfg.filename,
-                                cfg.tess.render,
-                                cfg.tess.clean)
+        attempt = 0
+        while not tessellation.tessellate(cfg.filename,
+                                          cfg.tess.render,
+                                          cfg.tess.clean,
+                                          cfg.tess.engine,
+                                          cfg.tess.validate,
+                                          cfg.tess.minedge or None,
+                                          cfg.tess.regedge,
+                                          cfg.tess.regface,
+                                          cfg.tess.gnuplot):
+            if not cfg.pack.active or attempt >= cfg.tess.repack:
+                raise Exception('Tessellation is not valid.')
+            attempt += 1
+            print(term.yellow + "Packing spheres again." + term.normal)
+            # repacked seed may belong to other run, thus cache is bypassed
+            pack(cfg, None if cfg.pack.seed is None
+                 else cfg.pack.seed + attempt, cache=False)
     if cfg.morph.active:
         print(term.yellow + "Creating final morphology." + term.normal)
         morphology.make_walls(cfg.filename,
@@ -156,5 +273,6 @@ def generate(cfg):
         smesh.structured_mesh(cfg.filename,
                               cfg.smesh.por,
                               cfg.smesh.strut)
+    artifacts.wait()
     time_end = datetime.datetime.now()
     print("Foam created in: {}".format(time_end - time_start))
@@ -9,8 +9,11 @@ from __future__ import print_function, division
 import os
 import re
 import shutil
+import itertools
 import subprocess as sp
 import numpy as np
+from scipy import sparse
+from scipy.spatial import cKDTree
 NAMES = {
     'point': 'Point',
     'line': 'Line',
@@ -23,6 +26,44 @@ NAMES = {
     'physical_surface': 'Physical Surface',
     'physical_volume': 'Physical Volume'
 }
+# keys of geometry data read from geo files
+GEO_KEYS = (
+    'point',
+    'line',
+    'line_loop',
+    'surface',
+    'physical_surface',
+    'surface_loop',
+    'volume',
+    'physical_volume'
+)
+# keys of geometry data for statement keywords (surfaces are special)
+KEYWORDS = {
+    'Point': 'point',
+    'Line': 'line',
+    'Line Loop': 'line_loop',
+    'Physical Surface': 'physical_surface',
+    'Surface Loop': 'surface_loop',
+    'Volume': 'volume',
+    'Physical Volume': 'physical_volume'
+}
+# entities stored in compressed format by GeometryStore
+CSR_KEYS = ('line', 'line_loop', 'surface', 'surface_loop', 'volume')
+# type of items of entities stored in compressed format
+CHILDREN = {
+    'line': 'point',
+    'line_loop': 'line',
+    'surface': 'line_loop',
+    'surface_loop': 'surface',
+    'volume': 'surface_loop'
+}
+# IDs of named physical volumes
+PHYSICAL_VOLUMES = {'"cells"': 1, '"walls"': 2}
+# one statement: keyword, ID in parentheses and list in curly braces
+STATEMENT = re.compile(
+    r'(Physical\s+Surface|Physical\s+Volume|Plane\s+Surface|Surface\s+Loop'
+    r'|Line\s+Loop|Point|Line|Surface|Volume)\s*[(]([^)]*)[)]\s*[=]\s*'
+    r'[{]([^}]*)[}][;]')
 NAME_LIST = [
     'point',
     'line',
@@ -54,11 +95,66 @@ def findall_top(regex, text):
     return lst
 
 
+def _statement_key(keyword, plane_surface=True):
+    """Get key of geometry data for statement keyword.
+
+    Args:
+        keyword (str): statement keyword, e.g., ``Line Loop``
+        plane_surface (bool, optional): surfaces use "Plane Surface" keyword
+
+    Returns:
+        str: key of geometry data, None if statement is not read
+    """
+    keyword = ' '.join(keyword.split())
+    if keyword == 'Plane Surface':
+        return 'surface' if plane_surface else None
+    if keyword == 'Surface':
+        return None if plane_surface else 'surface'
+    return KEYWORDS.get(keyword)
+
+
+def _convert(key, inds, bodies):
+    """Convert IDs and bodies of statements to extracted geometry data.
+
+    All statements of one kind are converted at once. Only coordinates are
+    taken from points. Point sizing if any is discarded. Orientation is
+    removed from other entities.
+
+    Args:
+        key (str): key of geometry data
+        inds (list): IDs of the elements
+        bodies (list): comma separated lists inside curly braces
+
+    Returns:
+        dict: data of the elements
+    """
+    if key == 'physical_volume':
+        inds = [PHYSICAL_VOLUMES.get(ind.strip(), ind.strip())
+                for ind in inds]
+    else:
+        inds = [int(ind) for ind in inds]
+    if not bodies:
+        return dict()
+    if key == 'point':  # point data consists of floats
+        # ignore the optional fourth argument (defines mesh coarseness)
+        items = [body.split(',')[0:3] for body in bodies]
+        coords = np.array(items, dtype=float)
+        coords[np.abs(coords) < 1e-8] = 0
+        return dict(zip(inds, coords))
+    # other data consists of integers
+    lengths = [body.count(',') + 1 for body in bodies]
+    flat = np.abs(np.array(','.join(bodies).split(','), dtype=int)).tolist()
+    ends = itertools.accumulate(lengths)
+    return {ind: flat[end - length:end]
+            for ind, end, length in zip(inds, ends, lengths)}
+
+
 def read_geo(geo_file, plane_surface=True):
     """Read ``gmsh`` input file and extract geometry information.
 
-    Uses regular expressions. Some geo files use Surface, some Plane Surface.
-    You should specify what you want to read.
+    File is tokenized in one pass by ``STATEMENT`` regular expression. Some
+    geo files use Surface, some Plane Surface. You should specify what you
+    want to read.
 
     Args:
         geo_file (str): input filename
@@ -70,38 +166,42 @@ def read_geo(geo_file, plane_surface=True):
     """
     with open(geo_file, "r") as text_file:
         text = text_file.read()
-        sdat = {}
-        rexp = {}
-        rexp['point'] = r'Point\s?[(][0-9]+[)]\s[=]\s[{](.*?)[}][;]'
-        rexp['line'] = r'Line\s?[(][0-9]+[)]\s[=]\s[{][0-9]+[,]\s?[0-9]+[}][;]'
-        rexp['line_loop'] = (
-            r'Line\sLoop\s?[(][0-9]+[)]\s[=]\s[{]([+-]?[0-9]+[,]?\s?)+[}][;]'
-        )
-        if plane_surface:
-            rexp['surface'] = (
-                r'Plane\sSurface\s?[(][0-9]+[)]\s[=]\s[{]([0-9]+[,]?\s?)+[}][;]'
-            )
-        else:
-            rexp['surface'] = (
-                r'(Surface\s[(][0-9]+[)]\s[=]\s[{]([0-9]+[,]?)+[}][;])'
-                + r'(?!.*Physical.*)',
-            )
-        rexp['physical_surface'] = (
-            r'Physical\sSurface\s?[(][0-9]+[)]\s[=]\s[{]([0-9]+[,]?\s?)+[}][;]'
-        )
-        rexp['surface_loop'] = (
-            r'Surface\sLoop\s?[(][0-9]+[)]\s[=]\s[{]([+-]?[0-9]+[,]?\s?)+[}][;]'
-        )
-        rexp['volume'] = (
-            r'Volume\s?[(][0-9]+[)]\s[=]\s[{]([0-9]+[,]?\s?)+[}][;]'
-        )
-        rexp['physical_volume'] = (
-            r'Physical\sVolume\s?[(]["][a-z]+["][)]\s[=]\s'
-            + r'[{]([0-9]+[,]?\s?)+[}][;]'
-        )
-        for key in rexp:
-            sdat[key] = findall_top(rexp[key], text)
-        return sdat
+    sdat = {key: [] for key in GEO_KEYS}
+    for match in STATEMENT.finditer(text):
+        key = _statement_key(match.group(1), plane_surface)
+        if key is not None:
+            sdat[key].append(match.group(0))
+    return sdat
+
+
+def parse_geo(geo_file, plane_surface=True):
+    """Read ``gmsh`` input file directly to extracted geometry data.
+
+    Equivalent to :func:`read_geo` followed by :func:`extract_data`, but
+    statements are tokenized in one pass and each kind of statements is
+    converted at once, without intermediate strings.
+
+    Args:
+        geo_file (str): input filename
+        plane_surface (bool, optional): input file contains "Plane Surface"
+            keyword
+
+    Returns:
+        dict: extracted geometry data
+    """
+    with open(geo_file, "r") as text_file:
+        text = text_file.read()
+    inds = {key: [] for key in GEO_KEYS}
+    bodies = {key: [] for key in GEO_KEYS}
+    keys = dict()  # keys of keywords as they appear in the file
+    for keyword, ind, body in STATEMENT.findall(text):
+        if keyword not in keys:
+            keys[keyword] = _statement_key(keyword, plane_surface)
+        key = keys[keyword]
+        if key is not None:
+            inds[key].append(ind)
+            bodies[key].append(body)
+    return {key: _convert(key, inds[key], bodies[key]) for key in GEO_KEYS}
 
 
 def fix_strings(strings):
@@ -188,32 +288,9 @@ def extract_data(sdat):
     """
     edat = {}
     for key in sdat:
-        lines = dict()
-        for line in sdat[key]:
-            part = line.split("(")
-            if key == "physical_volume":
-                ind = part[1].split(")")[0]  # ID of the element
-                if ind == '"cells"':
-                    ind = 1
-                elif ind == '"walls"':
-                    ind = 2
-            else:
-                ind = int(part[1].split(")")[0])  # ID of the element
-            fraction = line.split("{")
-            fraction = fraction[1].split("}")
-            fraction = fraction[0].split(",")
-            if key == "point":  # point data consists of floats
-                # ignore the optional fourth argument (defines mesh coarseness)
-                fraction = np.array(fraction[0:3])
-                fraction = fraction.astype(np.float)
-                for j, number in enumerate(fraction):
-                    if abs(number) < 1e-8:
-                        fraction[j] = 0
-            else:  # other data consists of integers
-                fraction = np.array(fraction)
-                fraction = np.absolute(fraction.astype(np.int)).tolist()
-            lines[ind] = fraction
-        edat[key] = lines
+        matches = [STATEMENT.match(line) for line in sdat[key]]
+        edat[key] = _convert(key, [match.group(2) for match in matches],
+                             [match.group(3) for match in matches])
     return edat
 
 
@@ -254,39 +331,225 @@ def collect_strings(edat):
     return sdat
 
 
+class GeometryStore:
+    """Columnar container of geometry data.
+
+    Alternative to extracted geometry data (dictionaries of lists), which
+    allows vectorized geometry algorithms. Point coordinates are stored in
+    (N, 3) array ``point``. Other entities (see ``CSR_KEYS``) are stored in
+    compressed format, i.e., items of ``i``-th entity of type ``key`` are
+    ``items[key][ptr[key][i]:ptr[key][i + 1]]``. Items are IDs of entities of
+    type ``CHILDREN[key]`` including orientation (sign). IDs of entities are
+    stored in ``ids[key]`` in the original order. Other keys of extracted
+    geometry data (physical and periodic surfaces, etc.) are kept in
+    ``extra`` as they are.
+
+    Args:
+        ids (dict): IDs of entities of each type
+        point (ndarray): point coordinates
+        ptr (dict): pointers to the start of items of each entity
+        items (dict): items of entities
+        extra (dict, optional): other extracted geometry data
+    """
+
+    def __init__(self, ids, point, ptr, items, extra=None):
+        self.ids = ids
+        self.point = point
+        self.ptr = ptr
+        self.items = items
+        self.extra = extra if extra is not None else dict()
+        self._sorted = dict()
+
+    @classmethod
+    def from_edat(cls, edat):
+        """Create store from extracted geometry data.
+
+        Args:
+            edat (dict): extracted geometry data
+
+        Returns:
+            GeometryStore: geometry data
+        """
+        ids = {'point': np.fromiter(edat['point'], dtype=int,
+                                    count=len(edat['point']))}
+        point = np.array(list(edat['point'].values()), dtype=float).reshape(
+            -1, 3)
+        ptr, items = dict(), dict()
+        for key in CSR_KEYS:
+            data = edat.get(key, dict())
+            ids[key] = np.fromiter(data, dtype=int, count=len(data))
+            lengths = [len(value) for value in data.values()]
+            ptr[key] = np.concatenate(([0], np.cumsum(lengths))).astype(int)
+            items[key] = np.fromiter(
+                itertools.chain.from_iterable(data.values()), dtype=int,
+                count=ptr[key][-1])
+        extra = {key: value for key, value in edat.items()
+                 if key != 'point' and key not in CSR_KEYS}
+        return cls(ids, point, ptr, items, extra)
+
+    def to_edat(self):
+        """Convert store to extracted geometry data.
+
+        Returns:
+            dict: extracted geometry data
+        """
+        edat = {'point': dict(zip(self.ids['point'].tolist(),
+                                  self.point.copy()))}
+        for key in CSR_KEYS:
+            flat = self.items[key].tolist()
+            bounds = self.ptr[key].tolist()
+            edat[key] = {ind: flat[start:end] for ind, start, end in zip(
+                self.ids[key].tolist(), bounds[:-1], bounds[1:])}
+        edat.update(self.extra)
+        return edat
+
+    def to_strings(self):
+        """Convert store to string format.
+
+        Returns:
+            dict: geometry data in string format, see
+            :func:`collect_strings`
+        """
+        return collect_strings(self.to_edat())
+
+    def index(self, key, ids):
+        """Find positions of entities in arrays.
+
+        Args:
+            key (str): type of geometry
+            ids (ndarray): IDs of entities, orientation is ignored
+
+        Returns:
+            ndarray: positions of entities, -1 for unknown IDs
+        """
+        if key not in self._sorted:
+            order = np.argsort(self.ids[key], kind='stable')
+            self._sorted[key] = (self.ids[key][order], order)
+        known, order = self._sorted[key]
+        ids = np.abs(np.asarray(ids, dtype=int))
+        if not len(known):
+            return np.full(ids.shape, -1)
+        pos = np.minimum(np.searchsorted(known, ids), len(known) - 1)
+        return np.where(known[pos] == ids, order[pos], -1)
+
+    def members(self, key, pos=None):
+        """Get incidence of entities and their items.
+
+        Args:
+            key (str): type of geometry (one of ``CSR_KEYS``)
+            pos (ndarray, optional): positions of selected entities, all
+                entities are used by default
+
+        Returns:
+            tuple: position of entity (in ``pos`` if specified) and position
+            of item (entity of type ``CHILDREN[key]``, -1 if unknown) for each
+            item
+        """
+        if pos is None:
+            owner = np.repeat(np.arange(len(self.ids[key])),
+                              np.diff(self.ptr[key]))
+            return owner, self.index(CHILDREN[key], self.items[key])
+        pos = np.asarray(pos, dtype=int)
+        starts = self.ptr[key][pos]
+        counts = self.ptr[key][pos + 1] - starts
+        owner = np.repeat(np.arange(len(pos)), counts)
+        items = np.arange(counts.sum()) + np.repeat(
+            starts - np.cumsum(counts) + counts, counts)
+        return owner, self.index(CHILDREN[key], self.items[key][items])
+
+
 def surfaces_in_plane(edat, coord, direction):
     """Finds surfaces that lie completely in specified plane.
 
     Plane must be normal to one of cartesian axes.
 
     Args:
-        edat (dict): extracted geometry data
+        edat (dict or GeometryStore): extracted geometry data
         coord (float): point on the chosen axis
         direction (int): order of coordinate axis
 
     Returns:
         list: line loops in specified plane
     """
-    points_in_plane = []
-    for i, point in edat['point'].items():
-        if point[direction] == coord:
-            points_in_plane.append(i)
-    lines_in_plane = []
-    for i, line in edat['line'].items():
-        if line[0] in points_in_plane and line[1] in points_in_plane:
-            lines_in_plane.append(i)
-    line_loops_in_plane = []
-    for i, line_loop in edat['line_loop'].items():
-        log = True
-        for line in line_loop:
-            if line not in lines_in_plane:
-                log = False
-        if log:
-            line_loops_in_plane.append(i)
-    return line_loops_in_plane
-
-
-def other_surfaces(edat, surfs):
+    if not isinstance(edat, GeometryStore):
+        edat = GeometryStore.from_edat(edat)
+    points_in_plane = np.append(edat.point[:, direction] == coord, False)
+    owner, member = edat.members('line')
+    outside = np.bincount(owner, ~points_in_plane[member],
+                          minlength=len(edat.ids['line']))
+    lines_in_plane = np.append(outside == 0, False)
+    owner, member = edat.members('line_loop')
+    outside = np.bincount(owner, ~lines_in_plane[member],
+                          minlength=len(edat.ids['line_loop']))
+    return edat.ids['line_loop'][outside == 0].tolist()
+
+
+def _sparse(mapping, rows, cols):
+    """Convert mapping of IDs to lists of IDs to sparse matrix.
+
+    Signs of IDs (orientation) are ignored. Entries count occurrences.
+
+    Args:
+        mapping (dict): lists of column IDs for row IDs
+        rows (ndarray): sorted row IDs
+        cols (ndarray): sorted column IDs
+
+    Returns:
+        csr_matrix: incidence matrix
+    """
+    lengths = [len(value) for value in mapping.values()]
+    flat = np.abs(np.fromiter(itertools.chain.from_iterable(mapping.values()),
+                              dtype=int, count=sum(lengths)))
+    row = np.repeat(np.searchsorted(rows, list(mapping)), lengths)
+    col = np.searchsorted(cols, flat)
+    return sparse.csr_matrix((np.ones(len(flat), dtype=int), (row, col)),
+                             shape=(len(rows), len(cols)))
+
+
+def incidence(edat):
+    """Build sparse incidence matrices of geometry.
+
+    Rows and columns of matrices are ordered by sorted IDs of entities, which
+    are stored under keys ``point``, ``line``, ``surface``, ``surface_loop``
+    and ``volume``. Matrices (CSR) are stored under keys ``volume_surface``,
+    ``loop_surface`` (surface loops and their surfaces), ``surface_line`` and
+    ``line_point``. Entries count occurrences, e.g., surface used twice in
+    one volume. Volumes sharing a surface are stored as ``adjacency``.
+
+    Neighbors of ``i``-th volume are ``adjacency.indices[adjacency.indptr[i]:
+    adjacency.indptr[i + 1]]``. Build the incidence once and pass it to
+    functions using it.
+
+    Args:
+        edat (dict): extracted geometry data
+
+    Returns:
+        dict: incidence matrices and IDs of entities
+    """
+    ids = {key: np.array(sorted(edat[key]), dtype=int) for key in
+           ('point', 'line', 'line_loop', 'surface', 'surface_loop',
+            'volume')}
+    loop_line = _sparse(edat['line_loop'], ids['line_loop'], ids['line'])
+    surface_loop = _sparse(edat['surface'], ids['surface'], ids['line_loop'])
+    loop_surface = _sparse(edat['surface_loop'], ids['surface_loop'],
+                           ids['surface'])
+    volume_loop = _sparse(edat['volume'], ids['volume'], ids['surface_loop'])
+    volume_surface = (volume_loop @ loop_surface).tocsr()
+    adjacency = ((volume_surface > 0).astype(int)
+                 @ (volume_surface > 0).astype(int).T).tocsr()
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+    inc = {key: ids[key] for key in
+           ('point', 'line', 'surface', 'surface_loop', 'volume')}
+    inc['line_point'] = _sparse(edat['line'], ids['line'], ids['point'])
+    inc['surface_line'] = (surface_loop @ loop_line).tocsr()
+    inc['loop_surface'] = loop_surface
+    inc['volume_surface'] = volume_surface
+    inc['adjacency'] = adjacency
+    return inc
+
+
+def other_surfaces(edat, surfs, inc=None):
     """Find boundary surfaces, which are not in ``surfs``.
 
     Assumes that inner surfaces are shared by two volumes. Remove duplicates
@@ -295,81 +558,76 @@ def other_surfaces(edat, surfs):
     Args:
         edat (dict): extracted geometry data
         surfs (list): list of surfaces, which should not be returned
+        inc (dict, optional): incidence of geometry, see :func:`incidence`
 
     Returns:
         list: boundary surfaces, which are not in ``surfs``
     """
-    all_surfaces = []
-    for surface_loops in edat['volume'].values():
-        for surface_loop in surface_loops:
-            for surfaces in edat['surface_loop'][surface_loop]:
-                all_surfaces += edat['surface'][surfaces]
-    count = dict()
-    for surface in all_surfaces:
-        if surface in count:
-            count[surface] += 1
-        else:
-            count[surface] = 1
-    surf = [
-        i for i, j in count.items() if j == 1
-        and i not in surfs
-    ]
-    return surf
+    if inc is None:
+        inc = incidence(edat)
+    count = np.asarray(inc['volume_surface'].sum(axis=0)).ravel()
+    surf = inc['surface'][count == 1]
+    return surf[~np.isin(surf, surfs)].tolist()
 
 
 def periodic_surfaces(edat, surfaces, vec, eps=1e-8):
     """Find periodic surface pairs in specified direction.
 
     Only linear periodicity is supported. Checks for surfaces with points
-    offset by specified vector within a tolerance.
+    offset by specified vector within a tolerance. Periodic points are found
+    using KD-tree of boundary points, surfaces are matched by sorted IDs of
+    their points. Several directions can be processed at once, boundary points
+    are then collected only once.
 
     Args:
-        edat (dict): extracted geometry data
+        edat (dict or GeometryStore): extracted geometry data
         surfaces (list): boundary surfaces
-        vec (ndarray): offset vector specification
+        vec (ndarray): offset vector specification, or array of offset
+            vectors (one per row)
         eps (float, optional): tolerance
 
     Returns:
-        list: periodic surface pairs
+        list: periodic surface pairs, list of them for each offset vector if
+        array of vectors is specified
     """
-    surface_points = dict()  # point IDs for each boundary surface
-    boundary_points = dict()  # dictionary with only boundary points
-    for surface in surfaces:
-        surface_points[surface] = []
-        for line in edat['line_loop'][surface]:
-            for point in edat['line'][line]:
-                if point not in surface_points[surface]:
-                    surface_points[surface] += [point]
-                if point not in boundary_points:
-                    boundary_points[point] = edat['point'][point]
-    # sort point IDs so that you can compare later
-    for point in surface_points.values():
-        point.sort()
-    # dictionary with ID of periodic point for each point that has one
-    periodic_points = dict()
-    for i, point in boundary_points.items():
-        for j, secondpoint in boundary_points.items():
-            if np.sum(np.abs(point + vec - secondpoint)) < eps:
-                periodic_points[i] = j
-    psurfs = []  # list of periodic surface pairs (IDs)
-    for i, surface in surface_points.items():
-        # Try to create surface using IDs of periodic points. Use None if there
-        # is no periodic point in specified direction.
-        per_surf = [
-            periodic_points[point] if point in periodic_points else None
-            for point in surface
-        ]
-        if None not in per_surf:
-            per_surf.sort()  # sort so you can find it
-            # use ID of current surface and find ID of periodic surface
-            psurfs.append(
-                [
-                    i,
-                    list(surface_points.keys())[
-                        list(surface_points.values()).index(per_surf)
-                    ]
-                ]
-            )
+    if not isinstance(edat, GeometryStore):
+        edat = GeometryStore.from_edat(edat)
+    surfaces = list(dict.fromkeys(surfaces))
+    vecs = np.asarray(vec, dtype=float)
+    if not surfaces:
+        return [[] for _ in vecs.reshape(-1, 3)] if vecs.ndim > 1 else []
+    # points of boundary surfaces
+    owner, lines = edat.members('line_loop',
+                                edat.index('line_loop', surfaces))
+    powner, points = edat.members('line', lines)
+    pairs = np.unique(np.column_stack((owner[powner], points)), axis=0)
+    boundary, pairs[:, 1] = np.unique(pairs[:, 1], return_inverse=True)
+    point_ids = edat.ids['point'][boundary]
+    bounds = np.searchsorted(pairs[:, 0], np.arange(len(surfaces) + 1))
+    # surface for each sorted tuple of point IDs
+    signatures = dict()
+    for i, start, end in zip(surfaces, bounds[:-1], bounds[1:]):
+        signature = tuple(np.sort(point_ids[pairs[start:end, 1]]).tolist())
+        signatures.setdefault(signature, i)
+    coords = edat.point[boundary]
+    tree = cKDTree(coords)
+    psurfs = []  # list of periodic surface pairs (IDs) for each vector
+    for offset in vecs.reshape(-1, 3):
+        # ID of periodic point for each boundary point, -1 if it has none
+        dist, nearest = tree.query(coords + offset, p=1,
+                                   distance_upper_bound=eps)
+        periodic = np.where(dist < eps, point_ids[
+            np.minimum(nearest, len(boundary) - 1)], -1)
+        per_points = periodic[pairs[:, 1]]
+        psurfs.append([])
+        for i, start, end in zip(surfaces, bounds[:-1], bounds[1:]):
+            per_surf = per_points[start:end]
+            if not np.any(per_surf < 0):
+                signature = tuple(np.sort(per_surf).tolist())
+                if signature in signatures:
+                    psurfs[-1].append([i, signatures[signature]])
+    if vecs.ndim == 1:
+        return psurfs[0]
     return psurfs
 
 
@@ -378,6 +636,10 @@ def identify_duplicity(edat, key, number, eps):
 
     User should call :func:`remove_duplicity` instead.
 
+    Points closer than ``eps`` (in taxicab metric) are found using KD-tree.
+    Other entities are duplicit if they consist of the same items, they are
+    grouped by sorted items.
+
     Args:
         edat (dict): extracted geometry data
         key (str): type of geometry
@@ -385,23 +647,36 @@ def identify_duplicity(edat, key, number, eps):
         eps (float): tolerance
 
     Returns:
-        dict: duplicit objects
+        dict: duplicit objects, i.e., lower IDs of identical objects for each
+        ID that has any
     """
     dupl = dict()
+    ids = np.fromiter(edat[key], dtype=int, count=len(edat[key]))
     if number == 'float':
-        for i, item1 in edat[key].items():
-            for j, item2 in edat[key].items():
-                if i != j and i > j and np.sum(np.abs(item1 - item2)) < eps:
-                    if i not in dupl:
-                        dupl[i] = []
-                    dupl[i].append(j)
+        if not len(ids):
+            return dupl
+        coords = np.array(list(edat[key].values()), dtype=float)
+        pairs = cKDTree(coords).query_pairs(eps, p=1, output_type='ndarray')
+        pairs = pairs[
+            np.sum(np.abs(coords[pairs[:, 0]] - coords[pairs[:, 1]]), axis=1)
+            < eps]
+        pairs = np.concatenate((pairs, pairs[:, ::-1]))
+        pairs = pairs[ids[pairs[:, 0]] > ids[pairs[:, 1]]]
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        for i, j in zip(ids[pairs[:, 0]].tolist(), ids[pairs[:, 1]].tolist()):
+            if i not in dupl:
+                dupl[i] = []
+            dupl[i].append(j)
     elif number == 'integer':
-        for i, item1 in edat[key].items():
-            for j, item2 in edat[key].items():
-                if i != j and i > j and sorted(item1) == sorted(item2):
-                    if i not in dupl:
-                        dupl[i] = []
-                    dupl[i].append(j)
+        keys = [tuple(sorted(item)) for item in edat[key].values()]
+        groups = dict()
+        for i, item in zip(ids.tolist(), keys):
+            groups.setdefault(item, []).append(i)
+        for i, item in zip(ids.tolist(), keys):
+            if len(groups[item]) > 1:
+                same = [j for j in groups[item] if j < i]
+                if same:
+                    dupl[i] = same
     else:
         raise Exception('number argument must be float or integer')
     return dupl
@@ -463,7 +738,12 @@ def split_loops(edat, key):
     entries, respectively. Needed because gmsh unrolls geometry in a way, which
     is unusable with OpenCASCADE kernel.
 
-    This function is slow. It does not catch all loops.
+    Loops contained in other loop are found using inverted index (loops of
+    each item), so that only loops sharing items are compared. Holes are
+    found using original loops and removed from the containing loop only
+    after all loops are processed, thus the result does not depend on order
+    of loops. Loops with the same items are not holes of each other. Holes
+    are taken in the order of definition and must not overlap.
 
     Args:
         edat (dict): extracted geometry data
@@ -475,14 +755,32 @@ def split_loops(edat, key):
         key2 = 'volume'
     else:
         raise Exception('can be called only for line_loop or surface_loop')
-    for i, item1 in edat[key].items():
-        for j, item2 in edat[key].items():
-            if i != j and set(item2).issubset((set(item1))):
-                for value in item2:
-                    item1.remove(value)
-                edat[key][i] = item1
-                edat[key2][i] = [i, j]
-                break
+    order = {i: pos for pos, i in enumerate(edat[key])}
+    loops = {i: list(item) for i, item in edat[key].items()}
+    members = {i: set(item) for i, item in loops.items()}
+    index = dict()  # loops containing each item
+    for i, item in members.items():
+        for value in item:
+            index.setdefault(value, set()).add(i)
+    holes = dict()
+    for i, item in members.items():
+        shared = dict()  # number of shared items
+        for value in item:
+            for j in index[value]:
+                shared[j] = shared.get(j, 0) + 1
+        found = sorted((j for j, count in shared.items()
+                        if count == len(members[j]) < len(item)),
+                       key=order.get)
+        remaining = set(item)
+        for j in found:
+            if members[j] <= remaining:
+                remaining -= members[j]
+                holes.setdefault(i, []).append(j)
+    for i, found in holes.items():
+        for j in found:
+            for value in loops[j]:
+                edat[key][i].remove(value)
+        edat[key2][i] = [i] + found
 
 
 def move_to_box(infile, wfile, outfile, mvol):
@@ -624,7 +922,7 @@ def move_to_box(infile, wfile, outfile, mvol):
     shutil.move(wfile + '_unrolled', outfile)
 
 
-def create_walls(edat, wall_thickness=0.01):
+def create_walls(edat, wall_thickness=0.01, inc=None):
     """Creates walls by shring each cell.
 
     Each vertex is moved by toward the cell centroid as:
@@ -640,6 +938,7 @@ def create_walls(edat, wall_thickness=0.01):
     Args:
         edat (dict): extracted geometry data
         wall_thickness (float, optional): shrinking parameter
+        inc (dict, optional): incidence of geometry, see :func:`incidence`
 
     Returns:
         list: [cell data, wall data]
@@ -651,22 +950,20 @@ def create_walls(edat, wall_thickness=0.01):
     xdat['surface'] = dict()
     xdat['surface_loop'] = dict()
     xdat['volume'] = dict()
+    if inc is None:
+        inc = incidence(edat)
+    # points of each volume (surface loop)
+    loop_point = (inc['loop_surface'] @ inc['surface_line']
+                  @ inc['line_point'] > 0).astype(float).tocsr()
+    loop_point.sort_indices()
+    coords = np.array([edat['point'][point] for point in inc['point']])
+    total = loop_point @ coords / loop_point.sum(axis=1).A
     volume_points = dict()  # point IDs for each volume
-    for volume in edat['surface_loop']:
-        volume_points[volume] = []
-        for surface in edat['surface_loop'][volume]:
-            for line in edat['line_loop'][surface]:
-                for point in edat['line'][line]:
-                    if point not in volume_points[volume]:
-                        volume_points[volume] += [point]
-        volume_points[volume].sort()
     centroids = dict()  # centroid for each volume
-    for volume in edat['surface_loop']:
-        total = 0
-        for point in volume_points[volume]:
-            total += edat['point'][point]
-        total /= len(volume_points[volume])
-        centroids[volume] = total
+    for i, volume in enumerate(inc['surface_loop']):
+        volume_points[volume] = inc['point'][loop_point.indices[
+            loop_point.indptr[i]:loop_point.indptr[i + 1]]].tolist()
+        centroids[volume] = total[i]
     npoints = len(edat['point'])
     nlines = len(edat['line'])
     nsurfaces = len(edat['line_loop'])
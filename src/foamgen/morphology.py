@@ -19,6 +19,7 @@ from OCC.Core.TopoDS import TopoDS_Shape, TopoDS_Compound
 from OCC.Display.SimpleGui import init_display
 from OCC.Extend.TopologyUtils import TopologyExplorer
 from . import geo_tools as gt
+from .tessellation import read_tessellation, to_edat
 
 
 def make_walls(fname, wall_thickness, clean):
@@ -29,7 +30,7 @@ def make_walls(fname, wall_thickness, clean):
     for cells and walls). Final file merges generated file in gmsh-readable
     format.
 
-    FileTessellation.geo -> FileCells.geo + FileWalls.geo ->
+    FileTessellation.tess (or .npz) -> FileCells.geo + FileWalls.geo ->
     FileCellsBox.brep + FileWallsBox.brep -> FileMorphology.geo
 
     Args:
@@ -39,15 +40,15 @@ def make_walls(fname, wall_thickness, clean):
     """
     term = Terminal()
     # create walls
-    iname = fname + "Tessellation.geo"
     cname = fname + "Cells.geo"
     wname = fname + "Walls.geo"
     print(
         term.yellow
-        + "Starting from file {}.".format(iname)
+        + "Starting from tessellation {}.".format(fname)
         + term.normal
     )
-    ncells = add_walls(iname, cname, wname, wall_thickness)
+    ncells = add_walls(read_tessellation(fname), cname, wname,
+                       wall_thickness)
     # move foam to a periodic box and save it to a file
     iname = cname
     cname = fname + "CellsBox.brep"
@@ -69,10 +70,12 @@ def make_walls(fname, wall_thickness, clean):
 def add_walls(iname, cname, wname, wall_thickness):
     """Create walls by shrinking each cell.
 
-    Uses files in gmsh CAD format.
+    Uses files in gmsh CAD format. Tessellation is either read from ``.geo``
+    file or given directly as arrays (see
+    :func:`foamgen.tessellation.read_tessellation`).
 
     Args:
-        iname (str): input filename
+        iname (str or dict): input filename or tessellation
         cname (str): output filename with cells
         wname (str): output filename with walls
         wall_thickness (float): wall thickness parameter
@@ -80,15 +83,16 @@ def add_walls(iname, cname, wname, wall_thickness):
     Returns:
         int: number of cells
     """
-    # read Neper foam
-    sdat = gt.read_geo(iname)  # string data
-    # Neper creates physical surfaces, which we don't want
-    sdat.pop('physical_surface')
-    # remove orientation, OpenCASCADE compatibility
-    gt.fix_strings(sdat['line_loop'])
-    gt.fix_strings(sdat['surface_loop'])
+    if isinstance(iname, dict):
+        # without orientation, OpenCASCADE compatibility
+        edat = to_edat(iname, signed=False)
+    else:
+        # read Neper foam, orientation is removed (OpenCASCADE
+        # compatibility)
+        edat = gt.parse_geo(iname)
+        # Neper creates physical surfaces, which we don't want
+        edat.pop('physical_surface')
     # create walls
-    edat = gt.extract_data(sdat)
     cedat, wedat = gt.create_walls(edat, wall_thickness)
     sdat = gt.collect_strings(cedat)
     gt.save_geo(cname, sdat)
@@ -133,18 +137,18 @@ def finalize_geo(iname, oname, verbose, method='pythonocc'):
     Also remove point duplicity and restore OpenCASCADE compatibility.
     """
     # read boxed foam
-    sdat = gt.read_geo(iname)  # string data
-    edat = gt.extract_data(sdat)  # extracted data
+    edat = gt.parse_geo(iname)  # extracted data
     # duplicity of points, lines, etc. was created during moving to a box
     gt.remove_duplicity(edat)
     # restore OpenCASCADE compatibility
     gt.split_loops(edat, 'line_loop')
     gt.split_loops(edat, 'surface_loop')
     # identification of physical surfaces for boundary conditions
-    surf0 = gt.surfaces_in_plane(edat, 0.0, 2)
+    store = gt.GeometryStore.from_edat(edat)
+    surf0 = gt.surfaces_in_plane(store, 0.0, 2)
     if verbose:
         print('Z=0 surface IDs: {}'.format(surf0))
-    surf1 = gt.surfaces_in_plane(edat, 1.0, 2)
+    surf1 = gt.surfaces_in_plane(store, 1.0, 2)
     if verbose:
         print('Z=1 surface IDs: {}'.format(surf1))
     surf = gt.other_surfaces(edat, surf0 + surf1)
@@ -154,12 +158,8 @@ def finalize_geo(iname, oname, verbose, method='pythonocc'):
     # Boundaries will be defined in fenics/dolfin directly.
     # edat['physical_surface'] = {1:surf0, 2:surf1, 3:surf}
     # identification of periodic surfaces for periodic mesh creation
-    edat['periodic_surface_X'] = gt.periodic_surfaces(
-        edat, surf, np.array([1, 0, 0])
-    )
-    edat['periodic_surface_Y'] = gt.periodic_surfaces(
-        edat, surf, np.array([0, 1, 0])
-    )
+    psurfs = gt.periodic_surfaces(store, surf, np.eye(3)[:2])
+    edat['periodic_surface_X'], edat['periodic_surface_Y'] = psurfs
     if verbose:
         print(
             'surface IDs periodic in X: {}'.format(edat['periodic_surface_X'])
@@ -7,81 +7,359 @@ Packing module
 .. moduleauthor:: Mohammad Marvi-Mashhadi <mohammad.marvi@imdea.org>
 """
 from __future__ import division, print_function
-import struct
 import os
+import json
 import time
-import random
+import hashlib
+import shutil
+import tempfile
+import threading
 import subprocess
 import numpy as np
 import pandas as pd
 from scipy.stats import lognorm
+from scipy.spatial import cKDTree
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import spack
+from . import artifacts
+# little-endian records of binary packing files
+XYZD = np.dtype([('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('d', '<f8')])
+# maximum relative overlap of spheres in accepted packing
+MAX_OVERLAP = 1e-2
+# supported file formats of packing results
+FORMATS = ('csv', 'npz')
+# version of packing engines, change invalidates cached packings
+ENGINE_VERSION = 1
 
 
-def simple_packing(diam):
+def _periodic_delta(delta, length):
+    """Apply minimum image convention to coordinate differences.
+
+    Args:
+        delta (ndarray): coordinate differences
+        length (float): size of periodic domain
+
+    Returns:
+        ndarray: coordinate differences to the nearest periodic image
+    """
+    return delta - length * np.round(delta / length)
+
+
+def _hash_cells(centers, rads, size, ncell):
+    """Find cells of periodic spatial hash touched by spheres.
+
+    Each sphere is assigned to all cells overlapped by its bounding box.
+
+    Args:
+        centers (ndarray): sphere centers
+        rads (ndarray): sphere radii
+        size (float): cell size
+        ncell (int): number of cells per side of periodic domain
+
+    Returns:
+        tuple: sphere indices and IDs of touched cells
+    """
+    low = np.floor((centers - rads[:, None]) / size).astype(np.int64)
+    ext = np.floor((centers + rads[:, None]) / size).astype(np.int64)
+    ext = np.minimum(ext - low + 1, ncell)
+    num = np.prod(ext, axis=1)
+    owner = np.repeat(np.arange(len(centers)), num)
+    local = np.arange(num.sum()) - np.repeat(np.cumsum(num) - num, num)
+    ext = ext[owner]
+    cell = low[owner]
+    cell[:, 2] += local % ext[:, 2]
+    local //= ext[:, 2]
+    cell[:, 1] += local % ext[:, 1]
+    cell[:, 0] += local // ext[:, 1]
+    cell %= ncell
+    return owner, (cell[:, 0] * ncell + cell[:, 1]) * ncell + cell[:, 2]
+
+
+def _sphere_pairs(centers, rads, length, size, query=None, qrads=None):
+    """Find candidate pairs of overlapping spheres using periodic spatial hash.
+
+    Returned pairs contain all pairs of overlapping spheres (minimum image
+    convention) and some non-overlapping ones. If ``query`` is not given,
+    unique pairs between ``centers`` are returned. Otherwise, pairs between
+    ``query`` and ``centers`` are returned, possibly repeated.
+
+    Args:
+        centers (ndarray): indexed sphere centers
+        rads (ndarray): indexed sphere radii
+        length (float): size of periodic domain
+        size (float): approximate cell size
+        query (ndarray, optional): query sphere centers
+        qrads (ndarray, optional): query sphere radii
+
+    Returns:
+        tuple: indices of first (query) and second (indexed) spheres
+    """
+    ncell = max(1, int(length // size))
+    size = length / ncell
+    owner, cid = _hash_cells(centers, rads, size, ncell)
+    order = np.argsort(cid, kind='stable')
+    count = np.bincount(cid, minlength=ncell**3)
+    start = np.cumsum(count) - count
+    if query is None:
+        first, qcid = owner, cid
+    else:
+        first, qcid = _hash_cells(query, qrads, size, ncell)
+    cnt = count[qcid]
+    pos = np.repeat(start[qcid] - np.cumsum(cnt) + cnt, cnt)
+    second = owner[order[pos + np.arange(len(pos))]]
+    first = np.repeat(first, cnt)
+    if query is None:
+        keep = first < second
+        code = np.sort(first[keep] * len(centers) + second[keep])
+        code = code[np.diff(code, prepend=-1) != 0]
+        first, second = np.divmod(code, len(centers))
+    return first, second
+
+
+def _cover_voxels(avail, centers, rads, vsize, nvox):
+    """Mark voxels, which are completely covered by spheres, as unavailable.
+
+    Args:
+        avail (ndarray): availability of voxels of periodic domain
+        centers (ndarray): sphere centers
+        rads (ndarray): sphere radii
+        vsize (float): voxel size
+        nvox (int): number of voxels per side of periodic domain
+    """
+    owner, vid = _hash_cells(centers, rads, vsize, nvox)
+    vcen = (np.stack(np.unravel_index(vid, (nvox,) * 3), axis=1) + 0.5) * vsize
+    delta = _periodic_delta(vcen - centers[owner], nvox * vsize)
+    far = np.linalg.norm(np.abs(delta) + vsize / 2, axis=1)
+    avail[vid[far <= rads[owner]]] = False
+
+
+def simple_packing(diam, fraction=0.25, domain=1.0, timeout=60,
+                   centers=None):
     """Simple and fast algorithm for packing.
 
-    Often leads to overlapping spheres. Can lead to infinite loop, thus it
-    raises Exception after 10 s. Use of this algorithm at this stage is
-    discouraged.
+    Random sequential addition of spheres into periodic domain. Spheres are
+    inserted from the largest one. Candidate positions are tested in batches
+    against already placed spheres using periodic spatial hash, thus the
+    algorithm scales approximately linearly with number of spheres. Rejected
+    spheres are tried again in next batch. Candidates are drawn only from
+    voxels, which are not yet completely covered by exclusion zones of placed
+    spheres.
+
+    Size of the domain is chosen so that the spheres occupy ``fraction`` of
+    it. Random sequential addition cannot reach fractions higher than about
+    0.38 and it becomes very slow already well below this limit. The result is
+    scaled to ``domain``.
+
+    If initial ``centers`` are given, spheres, which do not overlap with
+    larger ones at these positions, are kept and only the rest is inserted.
 
     Args:
         diam (ndarray): array of sphere diameters
+        fraction (float, optional): volume fraction of spheres
+        domain (float, optional): size of domain
+        timeout (float, optional): maximum running time in seconds
+        centers (ndarray, optional): initial sphere centers, see
+            :func:`warm_start`
 
     Returns:
         DataFrame: center positions and diameters of spheres
 
     Raises:
-        Exception: when running for more than 10 s
+        Exception: when running for more than ``timeout`` seconds or when
+            there is no space left for remaining spheres
     """
-    number_of_cells = len(diam)
-    rads = diam / 2
-    rads.sort()
-    vol = sum((2 * rads)**3)
-    vol = vol * 1.40
-    lch = vol**(1.00 / 3.00)
-    centers = np.zeros((number_of_cells, 3))
-    finished = False
-    while not finished:
-        j = -1
-        timeout = time.time() + 10
-        while number_of_cells >= j:
-            if time.time() > timeout:
-                raise Exception('Timed out!')
-            j = j + 1
-            if j == number_of_cells:
-                finished = True
-                break
-            # pick new coordinates
-            pick_x = lch * random.random()
-            pick_y = lch * random.random()
-            pick_z = lch * random.random()
-            while (rads[j] < pick_x <= lch - rads[j] and
-                   rads[j] < pick_y <= lch - rads[j] and
-                   rads[j] < pick_z <= lch - rads[j]):
-                pick_x = lch * random.random()
-                pick_y = lch * random.random()
-                pick_z = lch * random.random()
-            centers[j][0] = pick_x
-            centers[j][1] = pick_y
-            centers[j][2] = pick_z
-            # new sphere must not overlap with already existing sphere
-            if j > 0:
-                for i in range(0, j):
-                    if ((((((pick_x - centers[i][0])**2) +
-                           ((pick_y - centers[i][1])**2) +
-                           ((pick_z - centers[i][2])**2))**0.5) -
-                         (rads[j] + rads[i])) < 0) and i != j:
-                        centers[j][0], centers[j][0], centers[j][0] = 0, 0, 0
-                        j = j - 1
-                        break
-    dtf = pd.DataFrame(centers, columns=('x', 'y', 'z'))
-    dtf['d'] = 2 * rads
+    diam = np.asarray(diam, dtype=float)
+    order = np.argsort(diam)[::-1]
+    diam = diam[order]
+    npart = len(diam)
+    lch = (np.pi / 6 * np.sum(diam**3) / fraction)**(1 / 3)
+    size = 1.5 * np.median(diam)
+    nvox = max(1, int(min(2 * lch / diam[-1], (32 * npart)**(1 / 3))))
+    vsize = lch / nvox
+    avail = np.ones(nvox**3, dtype=bool)
+    if centers is None:
+        centers = np.zeros((npart, 3))
+        placed = 0
+    else:
+        centers = np.asarray(centers, dtype=float)[order] * lch / domain % lch
+        # drop initial spheres overlapping with larger ones
+        i, j = _sphere_pairs(centers, diam / 2, lch, size)
+        dist = np.linalg.norm(
+            _periodic_delta(centers[i] - centers[j], lch), axis=1)
+        keep = np.ones(npart, dtype=bool)
+        keep[np.maximum(i, j)[dist < (diam[i] + diam[j]) / 2]] = False
+        order = np.concatenate((np.flatnonzero(keep), np.flatnonzero(~keep)))
+        diam = diam[order]
+        centers = centers[order]
+        placed = np.count_nonzero(keep)
+        _cover_voxels(avail, centers[:placed],
+                      (diam[:placed] + diam[-1]) / 2, vsize, nvox)
+    nfail = 0
+    timeout = time.time() + timeout
+    while placed < npart:
+        if time.time() > timeout:
+            raise Exception('Timed out!')
+        # batch of similar spheres, so that the large ones are not postponed
+        nbatch = np.count_nonzero(diam[placed:] >= 0.8 * diam[placed])
+        nbatch = min(nbatch, max(64, placed))
+        # several candidates per sphere when only few spheres remain, more
+        # after each unsuccessful batch
+        ntry = max(1, max(64, placed) // nbatch) * 2**min(nfail, 8)
+        owner = np.repeat(np.arange(nbatch), ntry)
+        vox = np.flatnonzero(avail)
+        if not len(vox):
+            raise Exception('No space left for remaining spheres.')
+        vox = vox[np.random.randint(len(vox), size=len(owner))]
+        cand = (np.stack(np.unravel_index(vox, (nvox,) * 3), axis=1)
+                + np.random.random_sample((len(owner), 3))) * vsize
+        dcand = diam[placed:placed + nbatch].copy()
+        valid = np.ones(len(owner), dtype=bool)
+        # new sphere must not overlap with already existing sphere
+        if placed:
+            i, j = _sphere_pairs(centers[:placed], diam[:placed] / 2, lch,
+                                 size, cand, dcand[owner] / 2)
+            dist = np.linalg.norm(
+                _periodic_delta(cand[i] - centers[j], lch), axis=1)
+            valid[i[dist < (dcand[owner[i]] + diam[j]) / 2]] = False
+        # keep first valid candidate of each sphere
+        ind = np.flatnonzero(valid)
+        ind = ind[np.diff(owner[ind], prepend=-1) != 0]
+        cand = cand[ind]
+        owner = owner[ind]
+        # nor with larger sphere from the same batch
+        accept = np.ones(len(ind), dtype=bool)
+        i, j = _sphere_pairs(cand, dcand[owner] / 2, lch, size)
+        dist = np.linalg.norm(_periodic_delta(cand[i] - cand[j], lch), axis=1)
+        accept[j[dist < (dcand[owner[i]] + dcand[owner[j]]) / 2]] = False
+        mask = np.zeros(nbatch, dtype=bool)
+        mask[owner[accept]] = True
+        nacc = np.count_nonzero(accept)
+        centers[placed:placed + nacc] = cand[accept]
+        _cover_voxels(avail, cand[accept],
+                      (dcand[owner[accept]] + diam[-1]) / 2, vsize, nvox)
+        diam[placed:placed + nbatch] = np.concatenate(
+            (dcand[mask], dcand[~mask]))
+        placed += nacc
+        nfail = 0 if nacc else nfail + 1
+    dtf = pd.DataFrame(centers * domain / lch, columns=('x', 'y', 'z'))
+    dtf['d'] = diam * domain / lch
+    return dtf
+
+
+def cr_packing(diam, domain=1.0, centers=None, contraction=0.01, tol=1e-3,
+               maxiter=100000, fraction=1.0):
+    """Collective rearrangement algorithm for packing.
+
+    Force-biased algorithm in the spirit of Jodrey-Tory and Moscinski-Bargiel
+    implemented directly using NumPy. Spheres with outer diameters, which are
+    initially too large to fit into the domain, are repeatedly pushed apart
+    along the lines connecting overlapping pairs, while the outer diameters
+    are contracted towards the inner diameters (largest non-overlapping
+    ones). Overlapping pairs are found using Verlet list built from periodic
+    spatial hash, which is rebuilt only after spheres move far enough.
+
+    The algorithm stops when relative difference between outer and inner
+    diameters drops below ``tol``. Inner diameters are returned, thus the
+    spheres never overlap.
+
+    Args:
+        diam (ndarray): array of sphere diameters
+        domain (float, optional): size of domain
+        centers (ndarray, optional): initial sphere centers, random if not
+            given
+        contraction (float, optional): relative contraction of the gap
+            between outer and inner diameters in each iteration
+        tol (float, optional): relative tolerance of outer and inner diameters
+        maxiter (int, optional): maximum number of iterations
+        fraction (float, optional): initial volume fraction of outer
+            diameters, lower value converges faster for good initial centers
+
+    Returns:
+        DataFrame: center positions and diameters of spheres
+    """
+    diam = np.asarray(diam, dtype=float) / domain
+    npart = len(diam)
+    if centers is None:
+        centers = np.random.random_sample((npart, 3))
+    else:
+        centers = np.asarray(centers, dtype=float) / domain % 1.0
+    # outer diameters fill given fraction of the domain at the start
+    scale = (np.pi / 6 * np.sum(diam**3) / fraction)**(-1 / 3)
+    size = 1.5 * scale * np.median(diam)
+    skin = 0.5 * scale * np.min(diam)
+    moved = None
+    for _ in range(maxiter):
+        if moved is None or np.max(np.linalg.norm(moved, axis=1)) > skin / 2:
+            first, second = _sphere_pairs(
+                centers, (scale * diam + skin) / 2, 1.0, size)
+            moved = np.zeros((npart, 3))
+        delta = _periodic_delta(centers[first] - centers[second], 1.0)
+        dist = np.linalg.norm(delta, axis=1)
+        contact = (diam[first] + diam[second]) / 2
+        inner = min(scale, np.min(dist / contact)) if len(dist) else scale
+        if scale - inner < tol * scale:
+            break
+        # push overlapping spheres apart, the smaller one moves more
+        over = np.flatnonzero(dist < scale * contact)
+        ind1, ind2 = first[over], second[over]
+        push = (scale * contact[over] - dist[over]) / np.maximum(
+            dist[over], 1e-12 * scale) / (diam[ind1]**3 + diam[ind2]**3)
+        step = np.zeros((npart, 3))
+        for k in range(3):
+            step[:, k] = (
+                np.bincount(ind1, push * diam[ind2]**3 * delta[over, k], npart)
+                - np.bincount(ind2, push * diam[ind1]**3 * delta[over, k],
+                              npart))
+        centers = (centers + step) % 1.0
+        moved += step
+        scale -= contraction * (scale - inner)
+    print('Final porosity:', 1 - np.pi / 6 * np.sum((inner * diam)**3))
+    dtf = pd.DataFrame(centers * domain, columns=('x', 'y', 'z'))
+    dtf['d'] = inner * diam * domain
     return dtf
 
 
-def create_input(npart, domain=1.0):
+def warm_start(init, diam, domain=1.0):
+    """Prepare initial sphere centers from previous packing.
+
+    Spheres of previous packing are kept, randomly chosen ones are removed if
+    there are too many of them, and missing spheres are inserted at random
+    positions. New diameters are assigned according to the rank of the old
+    ones, thus large spheres are placed where large spheres were. Inserted
+    spheres are ranked as randomly chosen old spheres.
+
+    Args:
+        init (DataFrame): previous packing with center positions and
+            diameters of spheres
+        diam (ndarray): array of new sphere diameters
+        domain (float, optional): size of domain
+
+    Returns:
+        ndarray: initial sphere centers ordered as ``diam``
+
+    Raises:
+        Exception: when previous packing is empty
+    """
+    diam = np.asarray(diam, dtype=float)
+    npart = len(diam)
+    old = init[['x', 'y', 'z', 'd']].values
+    if not len(old):
+        raise Exception('Previous packing is empty.')
+    if len(old) > npart:
+        old = old[np.random.choice(len(old), npart, replace=False)]
+    nnew = npart - len(old)
+    rank = np.concatenate(
+        (old[:, 3], old[np.random.randint(len(old), size=nnew), 3]))
+    pos = np.concatenate(
+        (old[:, :3] % domain, np.random.random_sample((nnew, 3)) * domain))
+    order = np.argsort(rank, kind='stable')
+    centers = np.empty((npart, 3))
+    centers[np.argsort(diam, kind='stable')] = pos[order]
+    return centers
+
+
+def create_input(npart, domain=1.0, seed=341, path='.', generate=True):
     """Create input file for packing-generation program.
 
     Function creates ``generation.conf`` file with some default inputs.
@@ -89,20 +367,48 @@ def create_input(npart, domain=1.0):
     Args:
         npart (int): number of spheres
         domain (float, optional): size of domain
+        seed (int, optional): seed of random number generator
+        path (str, optional): working directory
+        generate (bool, optional): generate initial packing if True,
+            otherwise it is read from ``packing.xyzd``, see
+            :func:`create_init`
     """
     txt = """Particles count: {0}
 Packing size: {1} {1} {1}
-Generation start: 1
-Seed: 341
+Generation start: {3}
+Seed: {2}
 Steps to write: 1000
 Boundaries mode: 1
 Contraction rate: 1.328910e-005
-    """.format(npart, domain)
-    with open('generation.conf', 'w') as fout:
+    """.format(npart, domain, seed, int(generate))
+    with open(os.path.join(path, 'generation.conf'), 'w') as fout:
         fout.write(txt)
 
 
-def make_csd(shape, scale, npart):
+def create_init(init, diam, domain=1.0, path='.'):
+    """Create initial packing for packing-generation program.
+
+    Function creates ``packing.xyzd`` file with sphere centers prepared by
+    :func:`warm_start`. Diameters are scaled to occupy the same volume
+    fraction as in previous packing. Packing-generation program keeps its own
+    copy of initial packing in ``packing_init.xyzd``.
+
+    Args:
+        init (DataFrame): previous packing with center positions and
+            diameters of spheres
+        diam (ndarray): array of new sphere diameters
+        domain (float, optional): size of domain
+        path (str, optional): working directory
+    """
+    diam = np.asarray(diam, dtype=float)
+    data = np.empty(len(diam), dtype=XYZD)
+    centers = warm_start(init, diam, domain)
+    data['x'], data['y'], data['z'] = centers.T
+    data['d'] = diam * (np.sum(init['d']**3) / np.sum(diam**3))**(1 / 3)
+    data.tofile(os.path.join(path, 'packing.xyzd'))
+
+
+def make_csd(shape, scale, npart, path='.'):
     """Create cell size distribution and save it to file.
 
     Log-normal distribution from scipy is used. Creates ``diameters.txt`` file
@@ -112,6 +418,7 @@ def make_csd(shape, scale, npart):
         shape (float): shape size parameter of log-normal distribution
         scale (float): scale size parameter of log-normal distribution
         npart (int): number of spheres
+        path (str, optional): working directory
 
     Returns:
         ndarray: array of sphere diameters
@@ -120,7 +427,7 @@ def make_csd(shape, scale, npart):
         diam = [scale + 0 * x for x in range(npart)]
     else:
         diam = lognorm.rvs(shape, scale=scale, size=npart)
-    with open('diameters.txt', 'w') as fout:
+    with open(os.path.join(path, 'diameters.txt'), 'w') as fout:
         for rad in diam:
             fout.write('{0}\n'.format(rad))
     return diam
@@ -145,43 +452,274 @@ def save_csd(fname, diam, shape, scale, show_plot=False):
     else:
         xpos = np.linspace(lognorm.ppf(0.01, shape, scale=scale),
                            lognorm.ppf(0.99, shape, scale=scale), 100)
-    plt.figure(figsize=(12, 8))
-    plt.rcParams.update({'font.size': 16})
-    plt.plot(xpos, lognorm.pdf(xpos, shape, scale=scale), lw=3, label='input')
-    plt.hist(diam, density=True, label='spheres')
-    plt.grid()
-    plt.xlabel('Size')
-    plt.ylabel('Probability density function')
-    plt.legend()
-    plt.savefig(fname + 'Packing_histogram.png', dpi=300)
-    plt.savefig(fname + 'Packing_histogram.pdf')
+    with plt.rc_context({'font.size': 16}):
+        if show_plot:
+            fig = plt.figure(figsize=(12, 8))
+        else:
+            # figure without pyplot can be rendered in background thread
+            fig = Figure(figsize=(12, 8))
+        axs = fig.subplots()
+        axs.plot(xpos, lognorm.pdf(xpos, shape, scale=scale), lw=3,
+                 label='input')
+        axs.hist(diam, density=True, label='spheres')
+        axs.grid()
+        axs.set_xlabel('Size')
+        axs.set_ylabel('Probability density function')
+        axs.legend()
+        fig.savefig(fname + 'Packing_histogram.png', dpi=300)
+        fig.savefig(fname + 'Packing_histogram.pdf')
     if show_plot:
         plt.show()
+        plt.close(fig)
 
 
-def read_results():
+def read_results(path='.'):
     """Reads results of packing algorithm.
 
     Packing results are read from ``packing.nfo`` and ``packing.xyzd`` files.
+    Binary ``packing.xyzd`` file is read directly to structured array, thus
+    peak memory usage is about the size of the file.
+
+    Args:
+        path (str, optional): working directory
 
     Returns:
         DataFrame: center positions and diameters of spheres
     """
-    with open("packing.nfo", "r") as fin:
+    with open(os.path.join(path, "packing.nfo"), "r") as fin:
         fin.readline()
         fin.readline()
         por_theory = float(fin.readline().split()[2])
         por_final = float(fin.readline().split()[2])
         print('Theoretical porosity:', por_theory)
         print('Final porosity:', por_final)
-    data = pd.DataFrame(columns=('x', 'y', 'z', 'd'))
-    with open("packing.xyzd", "rb") as fin:
-        btxt = fin.read()
-        txt = list(struct.unpack("<" + "d" * (len(btxt) // 8), btxt))
-        data = pd.DataFrame(np.reshape(txt, (-1, 4)),
-                            columns=('x', 'y', 'z', 'd'))
-    data['d'] = data['d'] * ((1 - por_final) / (1 - por_theory))**(1 / 3)
-    return data
+    # file is read directly into one array, which is then used by DataFrame
+    data = np.fromfile(os.path.join(path, "packing.xyzd"), dtype=XYZD)
+    data['d'] *= ((1 - por_final) / (1 - por_theory))**(1 / 3)
+    return pd.DataFrame(data.view('<f8').reshape(-1, 4),
+                        columns=XYZD.names, copy=False)
+
+
+def load_packing(filename):
+    """Load packing from file.
+
+    Format is given by file extension. ``*.npz`` files contain one array for
+    each column, other files are read as CSV.
+
+    Args:
+        filename (str): name of packing file
+
+    Returns:
+        DataFrame: center positions and diameters of spheres
+    """
+    if filename.endswith('.npz'):
+        with np.load(filename) as fin:
+            return pd.DataFrame({key: fin[key] for key in XYZD.names})
+    return pd.read_csv(filename)
+
+
+def save_packing(fname, data, fmt='csv'):
+    """Save packing to file.
+
+    Creates ``*Packing.csv`` or ``*Packing.npz`` file. Binary ``npz`` format
+    avoids formatting and parsing of text, which dominates the time of saving
+    and loading of large packings. Packing files of other formats with the
+    same base filename are removed, because they are stale.
+
+    Args:
+        fname (str): base filename
+        data (DataFrame): center positions and diameters of spheres
+        fmt (str, optional): file format, see ``FORMATS``
+
+    Raises:
+        Exception: when file format is not supported
+    """
+    if fmt == 'csv':
+        data.to_csv(fname + 'Packing.csv', index=None)
+    elif fmt == 'npz':
+        np.savez(fname + 'Packing.npz',
+                 **{key: data[key].values for key in XYZD.names})
+    else:
+        raise Exception('Unknown packing format {}.'.format(fmt))
+    for other in FORMATS:
+        if other != fmt and os.path.isfile(fname + 'Packing.' + other):
+            os.remove(fname + 'Packing.' + other)
+
+
+def read_packing(fname, fmt=None):
+    """Read packing saved by :func:`save_packing`.
+
+    Args:
+        fname (str): base filename
+        fmt (str, optional): file format (see ``FORMATS``), format of the
+            only existing packing file by default
+
+    Returns:
+        DataFrame: center positions and diameters of spheres
+
+    Raises:
+        Exception: when packing file does not exist or when format is not
+            given and packing exists in more formats
+    """
+    if fmt is None:
+        found = [ext for ext in FORMATS
+                 if os.path.isfile(fname + 'Packing.' + ext)]
+        if not found:
+            raise Exception(
+                'Packing file {}Packing.* not found.'.format(fname))
+        if len(found) > 1:
+            raise Exception('Packing {}Packing.* exists in more formats, '
+                            'specify the format.'.format(fname))
+        fmt = found[0]
+    fil = fname + 'Packing.' + fmt
+    if not os.path.isfile(fil):
+        raise Exception('Packing file {} not found.'.format(fil))
+    return load_packing(fil)
+
+
+def cache_key(shape, scale, npart, algorithm, seed, concurrent=False):
+    """Create key of packing cache.
+
+    Args:
+        shape (float): shape size parameter of log-normal distribution
+        scale (float): scale size parameter of log-normal distribution
+        npart (int): number of spheres
+        algorithm (str): name of packing algorithm
+        seed (int): seed of random number generator
+        concurrent (bool, optional): True if attempts run concurrently, see
+            :func:`parallel_packing`, which seeds attempts differently than
+            sequential attempts
+
+    Returns:
+        str: SHA-256 hash of packing parameters and ``ENGINE_VERSION``
+    """
+    params = [float(shape), float(scale), int(npart), algorithm, int(seed),
+              bool(concurrent), ENGINE_VERSION]
+    return hashlib.sha256(json.dumps(params).encode()).hexdigest()
+
+
+def load_cached(cache, key):
+    """Load packing from cache.
+
+    Modification time of the cached file is updated, so that recently used
+    packings are evicted last.
+
+    Args:
+        cache (str): cache directory
+        key (str): cache key, see :func:`cache_key`
+
+    Returns:
+        tuple: array of sphere diameters and DataFrame with center positions
+        and diameters of spheres, None if the packing is not cached
+    """
+    fil = os.path.join(cache, key + '.npz')
+    try:
+        with np.load(fil) as fin:
+            diam = fin['diam']
+            data = pd.DataFrame({col: fin[col] for col in XYZD.names})
+    except (IOError, KeyError, ValueError):
+        return None
+    os.utime(fil)
+    return diam, data
+
+
+def store_cached(cache, key, diam, data, size=1024):
+    """Store packing in cache.
+
+    File is written under temporary name and then renamed, thus concurrent
+    readers never see incomplete file. Least recently used packings are
+    deleted when the size of the cache exceeds the limit.
+
+    Args:
+        cache (str): cache directory
+        key (str): cache key, see :func:`cache_key`
+        diam (ndarray): array of sphere diameters
+        data (DataFrame): center positions and diameters of spheres
+        size (float, optional): maximum size of cache in MB
+    """
+    os.makedirs(cache, exist_ok=True)
+    fil = os.path.join(cache, key + '.npz')
+    tmp = '{}.{}.tmp.npz'.format(fil[:-4], os.getpid())
+    np.savez(tmp, diam=np.asarray(diam, dtype=float),
+             **{col: data[col].values for col in XYZD.names})
+    os.replace(tmp, fil)
+    files = [os.path.join(cache, name) for name in os.listdir(cache)
+             if name.endswith('.npz') and '.tmp.' not in name]
+    files.sort(key=os.path.getmtime)
+    total = sum(os.path.getsize(name) for name in files)
+    for name in files[:-1]:
+        if total <= size * 2**20:
+            break
+        total -= os.path.getsize(name)
+        try:
+            os.remove(name)
+        except OSError:
+            pass
+
+
+def packing_stats(data, domain=1.0, tol=1e-2, radius=None):
+    """Calculate contact and overlap statistics of packing.
+
+    Neighbouring spheres are found using periodic KD-tree. Two spheres are in
+    contact if the distance of their centers is at most ``1 + tol`` times
+    their mean diameter. Relative overlap of a pair is one minus the ratio of
+    center distance and mean diameter, each sphere gets the maximum of its
+    pairs. Local packing fraction is the volume of spheres with centers
+    within ``radius`` from sphere center divided by the volume of ball with
+    this radius. Radius is clamped to half of domain size, so that periodic
+    images of a sphere are not counted twice. Spheres with contact distance
+    longer than half of domain size (few-particle packings) are checked
+    against all other spheres using minimum image convention.
+
+    Args:
+        data (DataFrame): center positions and diameters of spheres
+        domain (float, optional): size of domain
+        tol (float, optional): relative tolerance of contact distance
+        radius (float, optional): radius of neighbourhood for local packing
+            fraction, twice the median diameter by default, at most half of
+            domain size
+
+    Returns:
+        DataFrame: number of contacts, maximum relative overlap and local
+        packing fraction of each sphere
+    """
+    pos = np.mod(data[['x', 'y', 'z']].values, domain)
+    pos[pos >= domain] = 0
+    diam = data['d'].values
+    npart = len(diam)
+    if radius is None:
+        radius = 2 * np.median(diam)
+    radius = min(radius, domain / 2)
+    reach = (1 + tol) * np.max(diam)
+    tree = cKDTree(pos, boxsize=domain)
+    pairs = tree.query_pairs(min(max(radius, reach), domain / 2),
+                             output_type='ndarray')
+    if reach > domain / 2:
+        # contacts of large spheres may be beyond the reach of periodic tree
+        big = np.flatnonzero((1 + tol) * (diam + diam.max()) > domain)
+        extra = np.column_stack((np.repeat(big, npart),
+                                 np.tile(np.arange(npart), len(big))))
+        extra = np.sort(extra[extra[:, 0] != extra[:, 1]], axis=1)
+        pairs = np.unique(np.concatenate((pairs, extra)), axis=0)
+    first, second = pairs[:, 0], pairs[:, 1]
+    dist = np.linalg.norm(_periodic_delta(pos[first] - pos[second], domain),
+                          axis=1)
+    ratio = dist / ((diam[first] + diam[second]) / 2)
+    contact = ratio <= 1 + tol
+    contacts = (np.bincount(first[contact], minlength=npart)
+                + np.bincount(second[contact], minlength=npart))
+    overlap = np.zeros(npart)
+    np.maximum.at(overlap, first, 1 - ratio)
+    np.maximum.at(overlap, second, 1 - ratio)
+    volume = np.pi / 6 * diam**3
+    near = dist <= radius
+    local = (volume + np.bincount(first[near], volume[second[near]], npart)
+             + np.bincount(second[near], volume[first[near]], npart))
+    return pd.DataFrame({
+        'contacts': contacts,
+        'overlap': overlap,
+        'fraction': local / (4 / 3 * np.pi * radius**3),
+    })
 
 
 def render_packing(fname, data, domain=1.0, pixels=1000):
@@ -205,17 +743,252 @@ def render_packing(fname, data, domain=1.0, pixels=1000):
                  height=pixels, antialiasing=0.0001)
 
 
-def generate_structure(flag):
+def _new_trace():
+    """Create empty convergence trace of packing-generation program.
+
+    Returns:
+        dict: convergence trace
+    """
+    now = time.time()
+    return {'start': now, 'last': now, 'offset': 0, 'time': [], 'energy': []}
+
+
+def _update_trace(trace, path='.'):
+    """Read new records of ``contraction_energies.txt`` into trace.
+
+    Only complete lines are read, the last number on each line is taken as
+    the energy. Lines, which cannot be parsed, are skipped.
+
+    Args:
+        trace (dict): convergence trace, see :func:`_new_trace`
+        path (str, optional): working directory
+    """
+    fil = os.path.join(path, 'contraction_energies.txt')
+    if not os.path.isfile(fil):
+        return
+    with open(fil, 'rb') as fin:
+        fin.seek(trace['offset'])
+        chunk = fin.read()
+    end = chunk.rfind(b'\n') + 1
+    trace['offset'] += end
+    now = time.time()
+    for line in chunk[:end].splitlines():
+        try:
+            energy = float(line.split()[-1])
+        except (IndexError, ValueError):
+            continue
+        trace['time'].append(now - trace['start'])
+        trace['energy'].append(energy)
+        trace['last'] = now
+
+
+def _stop_reason(trace, timeout=None, stall=None, window=None, rtol=1e-3):
+    """Check whether packing-generation program should be stopped.
+
+    Args:
+        trace (dict): convergence trace, see :func:`_new_trace`
+        timeout (float, optional): maximum running time in seconds
+        stall (float, optional): maximum time without progress in seconds
+        window (int, optional): number of energy records, in which the energy
+            must decrease
+        rtol (float, optional): relative decrease of energy within
+            ``window`` records
+
+    Returns:
+        str: reason for stopping, None if the program should continue
+    """
+    now = time.time()
+    energy = trace['energy']
+    if energy and not np.isfinite(energy[-1]):
+        return 'energy is not finite'
+    if timeout and now - trace['start'] > timeout:
+        return 'timed out after {:.0f} s'.format(now - trace['start'])
+    if stall and now - trace['last'] > stall:
+        return 'no progress for {:.0f} s'.format(now - trace['last'])
+    if window and len(energy) > window:
+        old = energy[-window - 1]
+        if energy[-1] > old - rtol * abs(old):
+            return 'energy did not decrease in last {} records'.format(window)
+    return None
+
+
+def _trace_frame(trace):
+    """Convert convergence trace to DataFrame.
+
+    Args:
+        trace (dict): convergence trace, see :func:`_new_trace`
+
+    Returns:
+        DataFrame: elapsed time in seconds and contraction energy
+    """
+    return pd.DataFrame({'time': trace['time'], 'energy': trace['energy']})
+
+
+def generate_structure(flag, path='.', timeout=None, stall=None, window=None,
+                       rtol=1e-3, poll=0.5):
     """Runs the packing algorithm.
 
     ``PackingGeneration.exe`` must exist. ``generation.conf`` must exist.
 
+    The program is monitored while it runs. Its output is echoed and new
+    records of ``contraction_energies.txt`` are collected. The program is
+    killed early, when it runs longer than ``timeout``, when it neither
+    writes output nor energy for ``stall`` seconds, when the energy does not
+    decrease by ``rtol`` (relatively) within ``window`` records, or when the
+    energy is not finite. Criteria, which are not given, are not checked.
+
     Args:
         flag (str): argument to be passed to packing-generation program
+        path (str, optional): working directory
+        timeout (float, optional): maximum running time in seconds
+        stall (float, optional): maximum time without progress in seconds
+        window (int, optional): number of energy records, in which the energy
+            must decrease
+        rtol (float, optional): relative decrease of energy within
+            ``window`` records
+        poll (float, optional): time between status checks in seconds
+
+    Returns:
+        DataFrame: convergence trace with elapsed time in seconds and
+        contraction energy
     """
-    if os.path.isfile("packing.nfo"):
-        os.remove("packing.nfo")
-    subprocess.Popen(['PackingGeneration.exe', flag]).wait()
+    for fil in ("packing.nfo", "contraction_energies.txt"):
+        if os.path.isfile(os.path.join(path, fil)):
+            os.remove(os.path.join(path, fil))
+    trace = _new_trace()
+    proc = subprocess.Popen(['PackingGeneration.exe', flag], cwd=path,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            universal_newlines=True)
+
+    def echo():
+        """Echo output of the program and record time of last output."""
+        for line in proc.stdout:
+            print(line, end='')
+            trace['last'] = time.time()
+
+    reader = threading.Thread(target=echo, daemon=True)
+    reader.start()
+    reason = None
+    while proc.poll() is None:
+        time.sleep(poll)
+        _update_trace(trace, path)
+        reason = _stop_reason(trace, timeout, stall, window, rtol)
+        if reason:
+            proc.kill()
+            print('Packing stopped: ' + reason)
+            break
+    proc.wait()
+    reader.join()
+    _update_trace(trace, path)
+    return _trace_frame(trace)
+
+
+def parallel_packing(shape, scale, npart, algorithm, maxit, nproc,
+                     poll=0.1, init=None, timeout=None, stall=None,
+                     window=None, rtol=1e-3, seed=341):
+    """Runs several attempts of the packing algorithm concurrently.
+
+    Each attempt draws its own size distribution and uses its own seed. It
+    runs in separate scratch directory, so that the attempts do not overwrite
+    each other's files. At most ``nproc`` attempts (limited by the number of
+    available cores) run at once, new attempt is started whenever previous
+    one fails. The successful attempt with the lowest index wins, so that the
+    result does not depend on ``nproc`` or on timing of the attempts. Once an
+    attempt succeeds, no new attempts are started, attempts with higher index
+    are killed and attempts with lower index are waited for, thus wall time
+    is bounded by the slowest of them. Scratch directories are deleted
+    afterwards.
+
+    Attempts are monitored in the same way as in :func:`generate_structure`,
+    however, only the energy records count as progress, because the output of
+    the program is discarded.
+
+    ``PackingGeneration.exe`` must exist.
+
+    Args:
+        shape (float): shape size parameter of log-normal distribution
+        scale (float): scale size parameter of log-normal distribution
+        npart (int): number of spheres
+        algorithm (str): name of packing algorithm
+        maxit (int): total number of attempts
+        nproc (int): maximum number of concurrent attempts
+        poll (float, optional): time between status checks in seconds
+        init (DataFrame, optional): previous packing used as initial
+            configuration, see :func:`create_init`
+        timeout (float, optional): maximum running time of an attempt in
+            seconds
+        stall (float, optional): maximum time without progress in seconds
+        window (int, optional): number of energy records, in which the energy
+            must decrease
+        rtol (float, optional): relative decrease of energy within
+            ``window`` records
+        seed (int, optional): seed of random number generator, attempts use
+            consecutive seeds starting from ``seed + 1``
+
+    Returns:
+        tuple: array of sphere diameters, DataFrame with center positions
+        and diameters of spheres, and DataFrame with convergence traces of
+        all attempts
+
+    Raises:
+        Exception: when all attempts failed
+    """
+    nproc = max(1, min(nproc, maxit, os.cpu_count() or 1))
+    scratch = tempfile.mkdtemp(prefix='foamgen_packing_')
+    running = dict()  # attempt, directory and diameters for each process
+    traces = dict()
+    started = 0
+    winner = None  # attempt, diameters and packing of the best success
+    try:
+        while running or (winner is None and started < maxit):
+            while winner is None and len(running) < nproc and started < maxit:
+                started += 1
+                print('Iteration: {}'.format(started))
+                path = os.path.join(scratch, str(started))
+                os.mkdir(path)
+                create_input(npart, seed=seed + started, path=path,
+                             generate=init is None)
+                diam = make_csd(shape, scale, npart, path)
+                if init is not None:
+                    create_init(init, diam, path=path)
+                proc = subprocess.Popen(
+                    ['PackingGeneration.exe', '-' + algorithm], cwd=path,
+                    stdout=subprocess.DEVNULL)
+                running[proc] = (started, path, diam)
+                traces[started] = _new_trace()
+            time.sleep(poll)
+            for proc in list(running):
+                attempt, path, diam = running[proc]
+                if winner is not None and attempt > winner[0]:
+                    proc.kill()
+                    proc.wait()
+                    del running[proc]
+                    continue
+                _update_trace(traces[attempt], path)
+                if proc.poll() is None:
+                    reason = _stop_reason(traces[attempt], timeout, stall,
+                                          window, rtol)
+                    if not reason:
+                        continue
+                    proc.kill()
+                    proc.wait()
+                    print('Iteration {} stopped: {}'.format(attempt, reason))
+                del running[proc]
+                if os.path.isfile(os.path.join(path, "packing.nfo")):
+                    winner = (attempt, diam, read_results(path))
+    finally:
+        for proc in running:
+            proc.kill()
+            proc.wait()
+        shutil.rmtree(scratch, ignore_errors=True)
+    if winner is None:
+        raise Exception(
+            'Packing algorithm failed. ' +
+            'Try to change number of particles or size distribution.')
+    trace = pd.concat(
+        [_trace_frame(traces[i]).assign(iteration=i) for i in sorted(traces)],
+        ignore_index=True)
+    return winner[1:] + (trace,)
 
 
 def clean_files():
@@ -235,12 +1008,23 @@ def clean_files():
 
 
 def pack_spheres(fname, shape, scale, number_of_cells, algorithm, maxit,
-                 render, clean):
+                 render, clean, nproc=1, init=None, timeout=None, stall=None,
+                 window=None, rtol=1e-3, fmt='csv', seed=None, cache=None,
+                 cache_size=1024):
     """Packs spheres into periodic domain.
 
-    Creates file ending ``Packing.csv`` with sphere centers and radii. Simple
-    model is implemented directly, other algorithms use Vasili Baranov's `code
-    <https://github.com/VasiliBaranov/packing-generation>`_.
+    Creates file ending ``Packing.csv`` (or ``Packing.npz``, see
+    :func:`save_packing`) with sphere centers and diameters. Simple
+    (``simple``) and collective rearrangement (``cr``) models are implemented
+    directly, other algorithms use Vasili Baranov's `code
+    <https://github.com/VasiliBaranov/packing-generation>`_. For these,
+    convergence traces of all tries are saved to file ending
+    ``PackingTrace.csv``. Size distribution histogram and picture of packing
+    are rendered in background, see :mod:`foamgen.artifacts`.
+
+    If ``seed`` and ``cache`` are given, packing is looked up in the cache
+    first and new packings are stored there (warm-started packings are not
+    cached). Cache is not used without ``seed``, which is reported.
 
     Args:
         fname (str): base filename
@@ -251,29 +1035,97 @@ def pack_spheres(fname, shape, scale, number_of_cells, algorithm, maxit,
         maxit (int): number of tries for packing algorithm
         render (bool): save picture of packing if True
         clean (bool): delete redundant files if True
+        nproc (int, optional): number of concurrent tries for packing
+            algorithm, successful try with the lowest index is used, see
+            :func:`parallel_packing`
+        init (str, optional): filename of previous packing (``*Packing.csv``
+            or ``*Packing.npz``) used as initial configuration, see
+            :func:`warm_start`
+        timeout (float, optional): maximum running time of one try in
+            seconds, see :func:`generate_structure`
+        stall (float, optional): maximum time without progress in seconds
+        window (int, optional): number of energy records, in which the energy
+            must decrease
+        rtol (float, optional): relative decrease of energy within
+            ``window`` records
+        fmt (str, optional): file format of packing, see :func:`save_packing`
+        seed (int, optional): seed of random number generator
+        cache (str, optional): cache directory
+        cache_size (float, optional): maximum size of cache in MB
 
     Raises:
-        Exception: when maximum number of iterations was reached
+        Exception: when maximum number of iterations was reached or when
+            spheres overlap by more than ``MAX_OVERLAP``
     """
-    if algorithm == 'simple':
+    if init:
+        init = load_packing(init)
+    else:
+        init = None
+    if seed is not None:
+        np.random.seed(seed)
+    key = None
+    cached = None
+    if cache and seed is None:
+        print('Warning: packing cache requires seed, cache is not used.')
+    if cache and seed is not None and init is None:
+        key = cache_key(shape, scale, number_of_cells, algorithm, seed,
+                        nproc > 1 and algorithm not in ('simple', 'cr'))
+        cached = load_cached(cache, key)
+    if cached is not None:
+        print('Packing loaded from cache.')
+        diam, data = cached
+    elif algorithm == 'simple':
+        diam = make_csd(shape, scale, number_of_cells)
+        centers = None if init is None else warm_start(init, diam)
+        data = simple_packing(diam, centers=centers)
+    elif algorithm == 'cr' and init is None:
+        diam = make_csd(shape, scale, number_of_cells)
+        data = cr_packing(diam)
+    elif algorithm == 'cr':
         diam = make_csd(shape, scale, number_of_cells)
-        data = simple_packing(diam)
+        # previous packing is already dense, no need to start from full domain
+        fraction = min(1.0, 1.3 * np.pi / 6 * np.sum(init['d']**3))
+        data = cr_packing(diam, centers=warm_start(init, diam),
+                          fraction=fraction)
+    elif nproc > 1:
+        diam, data, trace = parallel_packing(
+            shape, scale, number_of_cells, algorithm, maxit, nproc,
+            init=init, timeout=timeout, stall=stall, window=window, rtol=rtol,
+            seed=341 if seed is None else seed)
+        trace.to_csv(fname + 'PackingTrace.csv', index=None)
     else:
-        create_input(number_of_cells)
+        create_input(number_of_cells, generate=init is None,
+                     seed=341 if seed is None else seed)
+        traces = []
         for i in range(maxit):
             print('Iteration: {}'.format(i + 1))
             diam = make_csd(shape, scale, number_of_cells)
-            generate_structure('-' + algorithm)
+            if init is not None:
+                create_init(init, diam)
+            traces.append(generate_structure(
+                '-' + algorithm, timeout=timeout, stall=stall, window=window,
+                rtol=rtol).assign(iteration=i + 1))
             if os.path.isfile("packing.nfo"):
                 break
+        pd.concat(traces, ignore_index=True).to_csv(
+            fname + 'PackingTrace.csv', index=None)
         if not os.path.isfile("packing.nfo"):
             raise Exception(
                 'Packing algorithm failed. ' +
                 'Try to change number of particles or size distribution.')
         data = read_results()
-    save_csd(fname, diam, shape, scale)
-    data.to_csv(fname + 'Packing.csv', index=None)
+    stats = packing_stats(data)
+    print('Mean number of contacts:', stats['contacts'].mean())
+    print('Mean local packing fraction:', stats['fraction'].mean())
+    print('Maximum relative overlap:', stats['overlap'].max())
+    if stats['overlap'].max() > MAX_OVERLAP:
+        raise Exception('Spheres overlap by more than {:.0%}.'.format(
+            MAX_OVERLAP))
+    if key and cached is None:
+        store_cached(cache, key, diam, data, cache_size)
+    artifacts.submit(save_csd, fname, diam, shape, scale)
+    save_packing(fname, data, fmt)
     if render:
-        render_packing(fname, data)
+        artifacts.submit(render_packing, fname, data)
     if clean:
         clean_files()
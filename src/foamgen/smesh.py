@@ -96,7 +96,7 @@ def por_fs_res(delta, fname, dsize, porosity, strut_content):
     ``foamreconstr`` program is used to create struts and optimize strut
     content.
 
-    Requires ``*Tessellation.gnu`` file.
+    Requires ``*Tessellation.skel`` file.
 
     Args:
         delta (float): box size in voxels
@@ -142,7 +142,7 @@ def por_fs_res(delta, fname, dsize, porosity, strut_content):
         fhl.write("0\n")
         fhl.write(fname + "SMesh\n")
         fhl.write(fname + "SMesh.vtk\n")
-        fhl.write(fname + "Tessellation.gnu\n")
+        fhl.write(fname + "Tessellation.skel\n")
         fhl.write("name\n")
         fhl.write("descriptors.txt" + "\n")
         fhl.write("parameters.txt" + "\n")
@@ -7,38 +7,119 @@ Tessellation module
 .. moduleauthor:: Mohammad Marvi-Mashhadi <mohammad.marvi@imdea.org>
 """
 import os
+import re
+import hashlib
+import itertools
 import subprocess as sp
 import shlex as sx
+import numpy as np
 import pandas as pd
-from .geo_tools import read_geo, extract_data
+from scipy import sparse as sp_sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import lsqr
+from scipy.spatial import ConvexHull, cKDTree
+from .geo_tools import collect_strings, save_geo
+from .packing import read_packing
 from . import vtk_tools
+from . import artifacts
+# identifies binary skeleton file, see save_skeleton
+SKELETON_MAGIC = b'FGSKEL01'
+# columns of cell statistics, see cell_statistics
+STATS_COLUMNS = ('volume', 'area', 'faces', 'neighbors', 'sphericity')
+# increase to invalidate cached cell statistics
+STATS_VERSION = 1
+# problems found by validate_tessellation, which make tessellation invalid
+VALIDATION_PROBLEMS = ('unpaired_faces', 'open_cells', 'volume_mismatch')
+# problems found by validate_tessellation, which are only reported
+VALIDATION_WARNINGS = ('short_edges', 'degenerate_faces', 'nonplanar_faces')
 
 
-def tessellate(fname, visualize, clean):
+def tessellate(fname, visualize, clean, engine='neper', validate=True,
+               min_edge=None, reg_edge=0.0, reg_face=0.0, gnuplot=False):
     """Use Laguerre tessellation to create dry foam.
 
-    Uses `Neper <http://neper.sourceforge.net/>`_ for tessellation.
-    ``*Packing.csv`` must exists.
+    Uses `Neper <http://neper.sourceforge.net/>`_ (``neper`` engine) or
+    :func:`laguerre_tessellation` (``native`` engine) for tessellation.
+    ``*Packing.csv`` or ``*Packing.npz`` must exists. Picture of tessellation
+    is rendered in background, see :mod:`foamgen.artifacts`. Skeleton of
+    tessellation is saved by :func:`save_skeleton` and optionally also in
+    gnuplot format by :func:`save_gnuplot`.
+
+    Tessellation is optionally regularized by
+    :func:`regularize_tessellation` and checked by
+    :func:`validate_tessellation` right after it is created. Only topology
+    errors (unpaired faces, open cells, volume not filling the domain) make
+    tessellation invalid, short edges and small or non-planar faces are
+    reported as warnings. Invalid tessellation is not processed any further.
 
     Args:
         fname (str): base filename
         visualize (bool): create picture of tessellation if True
         clean (bool): delete redundant files if True
+        engine (str, optional): tessellation engine (neper or native)
+        validate (bool, optional): check tessellation if True
+        min_edge (float, optional): minimum edge length, see
+            :func:`validate_tessellation`
+        reg_edge (float, optional): collapse edges shorter than this fraction
+            of mean cell size
+        reg_face (float, optional): collapse faces smaller than this fraction
+            of squared mean cell size
+        gnuplot (bool, optional): save ``*Tessellation.gnu`` file if True
+
+    Returns:
+        bool: False if tessellation is not valid, True otherwise
+
+    Raises:
+        Exception: when engine is not known
     """
-    number_of_cells = prep(fname)
-    neper_tessellation(fname, number_of_cells)
+    if engine == 'neper':
+        number_of_cells = prep(fname)
+        neper_tessellation(fname, number_of_cells)
+        if os.path.isfile(fname + 'Tessellation.npz'):
+            # native or regularized tessellation from previous run
+            os.remove(fname + 'Tessellation.npz')
+        tess = read_tessellation(fname) if validate else None
+    elif engine == 'native':
+        tess = native_tessellation(fname)
+    else:
+        raise Exception('Unknown tessellation engine {}.'.format(engine))
+    if reg_edge > 0 or reg_face > 0:
+        tess = regularize_tessellation(fname, reg_edge, reg_face)
+    if validate:
+        report = validate_tessellation(tess, min_edge=min_edge)
+        print('Minimum edge length: {min_edge:.3g}, '.format(**report)
+              + 'maximum face non-planarity: {planarity:.3g}'.format(
+                  **report))
+        warnings = ['{}: {}'.format(key, report[key])
+                    for key in VALIDATION_WARNINGS if report[key]]
+        if warnings:
+            print('Warning: {} (use --tess.regedge and --tess.regface to '
+                  'regularize tessellation).'.format(', '.join(warnings)))
+        problems = ['{}: {}'.format(key, report[key])
+                    for key in VALIDATION_PROBLEMS if report[key]]
+        if problems:
+            print('Tessellation is not valid ({}).'.format(
+                ', '.join(problems)))
+            return False
     periodic_box(fname, 1, False)
-    save_gnuplot(fname)
-    if visualize:
-        neper_visualize(fname)
+    save_skeleton(fname)
+    if gnuplot:
+        save_gnuplot(fname)
+    if visualize and engine == 'neper':
+        artifacts.submit(neper_visualize, fname)
+    elif visualize:
+        print('Visualization of tessellation requires Neper engine.')
     if clean:
-        clean_files()
+        # visualization needs rads.txt
+        artifacts.run_after(clean_files)
+    return True
 
 
 def prep(fname):
     """Prepare input files for Neper.
 
-    Creates ``centers.txt`` and ``rads.txt`` files.
+    Creates ``centers.txt`` and ``rads.txt`` files. Packing is read by
+    :func:`foamgen.packing.read_packing`.
 
     Args:
         fname (str): base filename
@@ -46,7 +127,7 @@ def prep(fname):
     Returns:
         int: number of cells
     """
-    dtf = pd.read_csv(fname + 'Packing.csv')
+    dtf = read_packing(fname)
     dtf['r'] = dtf['d'] / 2
     dtf[['x', 'y', 'z']].to_csv('centers.txt', sep='\t', header=None,
                                 index=None)
@@ -57,8 +138,9 @@ def prep(fname):
 def neper_tessellation(fname, number_of_cells, rve_size=1):
     """Run Neper tessellation module.
 
-    Neper regularization is not available for periodic tessellations. Requires
-    ``centers.txt`` and ``rads.txt`` files.
+    Neper regularization is not available for periodic tessellations, use
+    :func:`regularize_tessellation` instead. Requires ``centers.txt`` and
+    ``rads.txt`` files.
 
     Args:
         fname (str): base filename
@@ -77,6 +159,923 @@ def neper_tessellation(fname, number_of_cells, rve_size=1):
     sp.Popen(sx.split(command)).wait()
 
 
+def _periodic_images(centers, domain, margin):
+    """Create periodic images of seeds within margin around domain.
+
+    Original seeds come first, thus their indices are kept.
+
+    Args:
+        centers (ndarray): seed positions in domain
+        domain (float): size of domain
+        margin (float): width of layer of images around domain
+
+    Returns:
+        tuple: positions, indices of original seeds and shifts of images
+    """
+    shifts = np.array(list(itertools.product((0, -1, 1), repeat=3)))
+    pos = centers[np.newaxis] + domain * shifts[:, np.newaxis]
+    inside = np.all((pos >= -margin) & (pos <= domain + margin), axis=2)
+    shift, seed = np.nonzero(inside)
+    return pos[shift, seed], seed, shifts[shift]
+
+
+def laguerre_tessellation(centers, rads, domain=1.0, margin=None):
+    """Compute periodic Laguerre tessellation.
+
+    Laguerre (power) diagram is dual to regular triangulation, which is
+    obtained as lower convex hull of seeds lifted to four dimensions as
+    :math:`(x, y, z, |x|^2 - r^2)`. Periodic images of seeds within
+    ``margin`` around the domain are added. Vertices of the cells are
+    checked, whether no seed outside the margin can be closer (in power
+    distance), otherwise the margin is enlarged.
+
+    Cells are not cut by the domain boundary, i.e., each cell surrounds its
+    seed. Face between a cell and periodic image of another cell is present
+    in both cells (shifted), face between two cells is shared.
+
+    Topology is returned in arrays (indices are zero-based). Faces and cells
+    are stored in compressed format, e.g., vertices of face ``i`` are
+    ``face_vertex[face_ptr[i]:face_ptr[i + 1]]``. Face vertices are ordered
+    counter-clockwise when looking against the direction from the first to
+    the second cell of the face. ``face_sign`` tells whether the edge is
+    traversed from its first to its second vertex in the face loop.
+    ``cell_sign`` is positive if the face normal points out of the cell.
+
+    Args:
+        centers (ndarray): seed positions
+        rads (ndarray): seed radii (weights)
+        domain (float, optional): size of periodic domain
+        margin (float, optional): initial width of layer of periodic images,
+            three times mean seed distance by default
+
+    Returns:
+        dict: tessellation with keys ``seed``, ``radius``, ``vertex``,
+        ``edge``, ``face_ptr``, ``face_vertex``, ``face_edge``,
+        ``face_sign``, ``face_cell``, ``face_shift``, ``cell_ptr``,
+        ``cell_face`` and ``cell_sign``
+    """
+    return _laguerre_tessellation(centers, rads, domain, margin)[0]
+
+
+def _laguerre_tessellation(centers, rads, domain, margin):
+    """Compute periodic Laguerre tessellation and its dual triangulation.
+
+    Args:
+        centers (ndarray): seed positions
+        rads (ndarray): seed radii (weights)
+        domain (float): size of periodic domain
+        margin (float): initial width of layer of periodic images
+
+    Returns:
+        tuple: tessellation (see :func:`laguerre_tessellation`), positions
+        of seeds (or their images) in tetrahedra dual to the vertices and
+        indices of the seeds, shapes (n, 4, 3) and (n, 4)
+    """
+    centers = np.mod(np.asarray(centers, dtype=float), domain)
+    rads = np.asarray(rads, dtype=float)
+    npart = len(centers)
+    if margin is None:
+        margin = 3 * domain * npart**(-1 / 3)
+    while True:
+        margin = min(margin, domain)
+        pos, seed, shift = _periodic_images(centers, domain, margin)
+        lifted = np.column_stack(
+            (pos, np.sum(pos**2, axis=1) - rads[seed]**2))
+        hull = ConvexHull(lifted)
+        lower = hull.equations[:, 3] < 0
+        tets = np.sort(hull.simplices[lower], axis=1)
+        eqs = hull.equations[lower]
+        # only tetrahedra of original cells are needed
+        keep = tets[:, 0] < npart
+        tets = tets[keep]
+        vert = -eqs[keep, :3] / (2 * eqs[keep, 3:4])
+        power = (np.sum((vert - pos[tets[:, 0]])**2, axis=1)
+                 - rads[seed[tets[:, 0]]]**2)
+        dist = np.min(np.minimum(vert + margin, domain + margin - vert),
+                      axis=1)
+        if margin >= domain or np.all(
+                dist**2 - np.max(rads)**2 >= power):
+            break
+        margin *= 1.5
+    # faces are dual to edges of triangulation, cell of the first seed owns
+    # the face, images have higher indices than original seeds
+    pairs = np.array(list(itertools.combinations(range(4), 2)))
+    first = tets[:, pairs[:, 0]].ravel()
+    second = tets[:, pairs[:, 1]].ravel()
+    owner = np.repeat(np.arange(len(tets)), len(pairs))
+    keep = (first < npart) & ((second >= npart) | (first < second))
+    first, second, owner = first[keep], second[keep], owner[keep]
+    order = np.lexsort((second, first))
+    first, second, owner = first[order], second[order], owner[order]
+    new = np.diff(first * len(pos) + second, prepend=-1) != 0
+    face = np.cumsum(new) - 1
+    fseed = np.column_stack((first[new], second[new]))
+    # order face vertices by angle around face normal
+    normal = pos[fseed[:, 1]] - pos[fseed[:, 0]]
+    normal /= np.linalg.norm(normal, axis=1)[:, np.newaxis]
+    count = np.bincount(face)
+    centroid = np.stack([np.bincount(face, vert[owner, k]) for k in range(3)],
+                        axis=1) / count[:, np.newaxis]
+    axis1 = np.cross(normal, np.eye(3)[np.argmin(np.abs(normal), axis=1)])
+    axis1 /= np.linalg.norm(axis1, axis=1)[:, np.newaxis]
+    axis2 = np.cross(normal, axis1)
+    rel = vert[owner] - centroid[face]
+    angle = np.arctan2(np.sum(rel * axis2[face], axis=1),
+                       np.sum(rel * axis1[face], axis=1))
+    order = np.lexsort((angle, face))
+    face_vertex = owner[order]
+    face_ptr = np.concatenate(([0], np.cumsum(count)))
+    # edges connect consecutive vertices of faces
+    nxt = np.arange(len(face_vertex)) + 1
+    nxt[face_ptr[1:] - 1] = face_ptr[:-1]
+    start, end = face_vertex, face_vertex[nxt]
+    key = np.minimum(start, end) * len(tets) + np.maximum(start, end)
+    ekey, face_edge = np.unique(key, return_inverse=True)
+    edge = np.column_stack(np.divmod(ekey, len(tets)))
+    face_sign = np.where(start < end, 1, -1)
+    # each face bounds the cell of the first seed (outward normal) and the
+    # cell of the second seed, if it is not a periodic image
+    nface = len(fseed)
+    inner = fseed[:, 1] < npart
+    cell = np.concatenate((fseed[:, 0], fseed[inner, 1]))
+    cface = np.concatenate((np.arange(nface), np.flatnonzero(inner)))
+    csign = np.concatenate((np.ones(nface, dtype=int),
+                            -np.ones(np.count_nonzero(inner), dtype=int)))
+    order = np.argsort(cell, kind='stable')
+    tess = {
+        'seed': centers,
+        'radius': rads,
+        'vertex': vert,
+        'edge': edge,
+        'face_ptr': face_ptr,
+        'face_vertex': face_vertex,
+        'face_edge': face_edge,
+        'face_sign': face_sign,
+        'face_cell': seed[fseed],
+        'face_shift': shift[fseed[:, 1]],
+        'cell_ptr': np.concatenate(
+            ([0], np.cumsum(np.bincount(cell, minlength=npart)))),
+        'cell_face': cface[order],
+        'cell_sign': csign[order],
+    }
+    return tess, pos[tets], seed[tets]
+
+
+class CellLocator:
+    """Locate cells of Laguerre tessellation containing given points.
+
+    Point belongs to the cell of seed with minimum power distance
+    :math:`|x - c|^2 - r^2`. Seeds are lifted to four dimensions as
+    :math:`(c, \\sqrt{R^2 - r^2})`, where :math:`R` is the maximum radius,
+    thus the nearest lifted seed to point :math:`(x, 0)` in Euclidean
+    distance is the nearest seed in power distance.
+
+    Nearest seeds are found by KD-tree of seeds and their periodic images
+    within ``margin`` around the domain, which is built once. Result is exact
+    if the nearest lifted seed is closer than ``margin``, because no seed
+    outside the margin can be closer. Remaining points are queried in
+    periodic KD-tree, which is slower.
+
+    Query is done by SciPy KD-tree and its throughput is about one million
+    points per second per thread (measured for 30 to 20000 seeds), i.e.,
+    it is not suitable for tens of millions of points per second.
+    Vectorized search among candidate seeds of a uniform grid was tried, but
+    it was at most two times faster in NumPy and much slower to build.
+    Use ``workers=-1`` to query in parallel.
+
+    Args:
+        centers (ndarray): seed positions
+        rads (ndarray): seed radii (weights)
+        domain (float, optional): size of periodic domain
+        margin (float, optional): width of layer of periodic images, two
+            times mean seed distance by default
+    """
+
+    def __init__(self, centers, rads, domain=1.0, margin=None):
+        centers = np.mod(np.asarray(centers, dtype=float), domain)
+        rads = np.asarray(rads, dtype=float)
+        if margin is None:
+            margin = 2 * domain * len(centers)**(-1 / 3)
+        self.domain = domain
+        self.margin = min(margin, domain)
+        self.rmax = rads.max()
+        lift = np.sqrt(self.rmax**2 - rads**2)
+        pos, self.seed, _ = _periodic_images(centers, domain, self.margin)
+        self.tree = cKDTree(np.column_stack((pos, lift[self.seed])))
+        # fourth dimension is not periodic, box is large enough to avoid
+        # wrapping of distances
+        self.periodic_tree = cKDTree(
+            np.column_stack((centers, lift)),
+            boxsize=[domain, domain, domain, 4 * self.rmax + domain])
+
+    @classmethod
+    def from_packing(cls, fname, domain=1.0):
+        """Create locator for packing.
+
+        Packing is read by :func:`foamgen.packing.read_packing`.
+
+        Args:
+            fname (str): base filename
+            domain (float, optional): size of periodic domain
+
+        Returns:
+            CellLocator: locator of cells
+        """
+        dtf = read_packing(fname)
+        return cls(dtf[['x', 'y', 'z']].values, dtf['d'].values / 2, domain)
+
+    def query(self, points, workers=1):
+        """Find cells containing points.
+
+        Args:
+            points (ndarray): point positions, shape (n, 3)
+            workers (int, optional): number of threads, all CPUs if -1
+
+        Returns:
+            tuple: cell (seed) indices and power distances to the seeds
+        """
+        lifted = np.zeros((len(points), 4))
+        lifted[:, :3] = np.mod(points, self.domain)
+        dist, image = self.tree.query(
+            lifted, distance_upper_bound=self.margin, workers=workers)
+        far = np.isinf(dist)
+        cell = self.seed[np.minimum(image, len(self.seed) - 1)]
+        if np.any(far):
+            dist[far], cell[far] = self.periodic_tree.query(
+                lifted[far], workers=workers)
+        return cell, dist**2 - self.rmax**2
+
+
+def to_edat(tess, signed=True):
+    """Convert tessellation to extracted geometry data.
+
+    IDs start from one. Empty cells are skipped and the other cells are
+    renumbered.
+
+    Args:
+        tess (dict): tessellation, see :func:`laguerre_tessellation`
+        signed (bool, optional): keep orientation of line and surface loops
+
+    Returns:
+        dict: extracted geometry data, see
+        :func:`foamgen.geo_tools.extract_data`
+    """
+    fptr, cptr = tess['face_ptr'], tess['cell_ptr']
+    edges = tess['face_edge'] + 1
+    faces = tess['cell_face'] + 1
+    if signed:
+        edges = edges * tess['face_sign']
+        faces = faces * tess['cell_sign']
+    loops = np.split(edges, fptr[1:-1])
+    shells = [shell for shell in np.split(faces, cptr[1:-1]) if len(shell)]
+    return {
+        'point': {i + 1: point for i, point in enumerate(tess['vertex'])},
+        'line': {i + 1: line for i, line in enumerate(
+            (tess['edge'] + 1).tolist())},
+        'line_loop': {i + 1: loop.tolist() for i, loop in enumerate(loops)},
+        'surface': {i + 1: [i + 1] for i in range(len(loops))},
+        'surface_loop': {i + 1: shell.tolist()
+                         for i, shell in enumerate(shells)},
+        'volume': {i + 1: [i + 1] for i in range(len(shells))},
+    }
+
+
+def _periodic_keys(points, domain, tol):
+    """Identify periodic copies of points.
+
+    Args:
+        points (ndarray): point positions
+        domain (float): size of periodic domain
+        tol (float): quantization step
+
+    Returns:
+        ndarray: the same ID for points, which are periodic copies
+    """
+    keys = np.mod(np.round(points / tol).astype(np.int64),
+                  int(round(domain / tol)))
+    return np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+
+
+def _collapse(tess, merge, vertex):
+    """Merge vertices and rebuild faces, edges and cells.
+
+    Consecutive repeated vertices of faces are removed and faces with less
+    than three vertices are deleted.
+
+    Args:
+        tess (dict): tessellation, see :func:`laguerre_tessellation`
+        merge (ndarray): new ID of each vertex
+        vertex (ndarray): positions of merged vertices
+
+    Returns:
+        tuple: tessellation and mask of faces with non-consecutive repeated
+        vertices
+    """
+    fptr, cptr = tess['face_ptr'], tess['cell_ptr']
+    nface = len(fptr) - 1
+    count = np.diff(fptr)
+    face = np.repeat(np.arange(nface), count)
+    verts = merge[tess['face_vertex']]
+    prev = np.arange(len(verts)) - 1
+    prev[fptr[:-1]] = fptr[1:] - 1
+    keep = verts != verts[prev]
+    face, verts = face[keep], verts[keep]
+    count = np.bincount(face, minlength=nface)
+    key = np.sort(face * len(merge) + verts)
+    pinched = np.zeros(nface, dtype=bool)
+    pinched[key[1:][np.diff(key) == 0] // len(merge)] = True
+    # delete degenerate faces
+    valid = count >= 3
+    newface = np.cumsum(valid) - 1
+    keep = valid[face]
+    face, verts = newface[face[keep]], verts[keep]
+    count = count[valid]
+    # delete unused vertices
+    used, verts = np.unique(verts, return_inverse=True)
+    face_ptr = np.concatenate(([0], np.cumsum(count)))
+    # edges connect consecutive vertices of faces
+    nxt = np.arange(len(verts)) + 1
+    nxt[face_ptr[1:] - 1] = face_ptr[:-1]
+    start, end = verts, verts[nxt]
+    ekey = np.minimum(start, end) * len(used) + np.maximum(start, end)
+    ekey, face_edge = np.unique(ekey, return_inverse=True)
+    cell = np.repeat(np.arange(len(cptr) - 1), np.diff(cptr))
+    ckeep = valid[tess['cell_face']]
+    out = {key: value for key, value in tess.items()
+           if key in ('seed', 'radius')}
+    out.update({
+        'vertex': vertex[used],
+        'edge': np.column_stack(np.divmod(ekey, len(used))),
+        'face_ptr': face_ptr,
+        'face_vertex': verts,
+        'face_edge': face_edge,
+        'face_sign': np.where(start < end, 1, -1),
+        'cell_ptr': np.concatenate(([0], np.cumsum(np.bincount(
+            cell[ckeep], minlength=len(cptr) - 1)))),
+        'cell_face': newface[tess['cell_face'][ckeep]],
+        'cell_sign': tess['cell_sign'][ckeep],
+    })
+    for key in ('face_cell', 'face_shift'):
+        if key in tess:
+            out[key] = tess[key][valid]
+    return out, pinched
+
+
+def _edge_jacobian(pos, seed, vert, edge, npart):
+    """Compute derivatives of edge vectors with respect to seed weights.
+
+    Vertex is the power center of seeds of its dual tetrahedron, i.e., the
+    solution of :math:`2 (p_k - p_0) \\cdot x = |p_k|^2 - |p_0|^2 - w_k + w_0`,
+    where :math:`w` are weights (squared radii), thus it is a linear function
+    of the weights for given topology.
+
+    Args:
+        pos (ndarray): positions of seeds of dual tetrahedra, see
+            :func:`_laguerre_tessellation`
+        seed (ndarray): indices of seeds of dual tetrahedra
+        vert (ndarray): vertex positions
+        edge (ndarray): vertices of edges
+        npart (int): number of seeds
+
+    Returns:
+        tuple: sparse matrix of derivatives (three rows for each edge) and
+        flattened edge vectors
+    """
+    inv = np.linalg.inv(2 * (pos[:, 1:] - pos[:, :1]))
+    deriv = np.concatenate((np.sum(inv, axis=2)[:, np.newaxis],
+                            -np.swapaxes(inv, 1, 2)), axis=1)
+    value = np.concatenate((deriv[edge[:, 0]], -deriv[edge[:, 1]]), axis=1)
+    row = 3 * np.arange(len(edge))[:, np.newaxis] + np.arange(3)
+    col = np.concatenate((seed[edge[:, 0]], seed[edge[:, 1]]), axis=1)
+    row, col = np.broadcast_arrays(row[:, np.newaxis], col[:, :, np.newaxis])
+    jac = sp_sparse.csr_matrix((value.ravel(), (row.ravel(), col.ravel())),
+                               shape=(3 * len(edge), npart))
+    return jac, (vert[edge[:, 0]] - vert[edge[:, 1]]).ravel()
+
+
+def regularize(tess, min_edge, min_area=0.0, domain=1.0, tol=1e-9,
+               maxiter=10):
+    """Remove short edges and small faces from tessellation.
+
+    Tessellation is recomputed by :func:`laguerre_tessellation` from its
+    seeds. Their weights (squared radii) are changed to shrink edges shorter
+    than ``min_edge`` and all edges of faces smaller than ``min_area`` to
+    zero length. Vertices are linear functions of weights (see
+    :func:`_edge_jacobian`), thus the change is the minimum norm solution of
+    linear system. Changed weights can make other edges short, thus it is
+    repeated at most ``maxiter`` times. Iterations stop early, when a cell
+    disappears, and the tessellation with the least short edges is used.
+    Result is still Laguerre tessellation, thus faces remain planar.
+
+    Connected groups of vertices of edges shorter than ``tol`` are finally
+    merged to one vertex at their centroid. Groups are found for vertices
+    identified with their periodic copies, thus all copies are collapsed in
+    the same way and periodicity is kept. Groups of vertices, which would
+    pinch a face (make it touch itself), are not merged. Faces, which lose
+    all but two vertices, are removed from cells. Short edges, which could
+    not be shrunk, are kept.
+
+    Args:
+        tess (dict): tessellation, see :func:`laguerre_tessellation`
+        min_edge (float): minimum edge length
+        min_area (float, optional): minimum face area
+        domain (float, optional): size of periodic domain
+        tol (float, optional): tolerance for zero edge length and periodic
+            copies of vertices
+        maxiter (int, optional): maximum number of changes of weights
+
+    Returns:
+        dict: regularized tessellation
+    """
+    centers = tess['seed']
+    weight = tess['radius']**2
+    best = None
+    for step in range(maxiter + 1):
+        # weights are defined up to a constant, radii must be real
+        current, pos, seed = _laguerre_tessellation(
+            centers, np.sqrt(weight - weight.min()), domain, None)
+        vert, edge = current['vertex'], current['edge']
+        length = np.linalg.norm(vert[edge[:, 1]] - vert[edge[:, 0]], axis=1)
+        short = length < min_edge
+        if min_area > 0:
+            _, area = face_geometry(current)
+            small = np.linalg.norm(area, axis=1) < min_area
+            fptr = current['face_ptr']
+            short[current['face_edge'][np.repeat(small, np.diff(fptr))]] = True
+        empty = np.count_nonzero(np.diff(current['cell_ptr']) == 0)
+        remaining = np.count_nonzero(short & (length >= tol))
+        if best is None:
+            nempty = empty
+        elif empty > nempty:
+            # change of topology is too large for linearization
+            break
+        if best is None or remaining < best[1]:
+            best = (current, remaining, length)
+        if remaining == 0 or step == maxiter:
+            break
+        jac, dist = _edge_jacobian(pos, seed, vert, edge[short],
+                                   len(centers))
+        weight = weight + lsqr(jac, -dist, atol=1e-12, btol=1e-12,
+                               iter_lim=20 * len(centers))[0]
+    tess, _, length = best
+    return _merge_vertices(tess, length < tol, domain, tol)
+
+
+def _merge_vertices(tess, short, domain, tol):
+    """Merge vertices connected by short edges, see :func:`regularize`.
+
+    Args:
+        tess (dict): tessellation, see :func:`laguerre_tessellation`
+        short (ndarray): mask of edges, which are collapsed
+        domain (float): size of periodic domain
+        tol (float): tolerance for periodic copies of vertices
+
+    Returns:
+        dict: tessellation with merged vertices
+    """
+    vert, edge = tess['vertex'], tess['edge']
+    # vertices and edges identified with their periodic copies
+    vkey = _periodic_keys(vert, domain, tol)
+    nkey = vkey.max() + 1
+    first = np.zeros(nkey, dtype=int)
+    first[vkey[::-1]] = np.arange(len(vkey))[::-1]
+    wrapped = np.mod(vert[first], domain)
+    cedge, ekey = np.unique(np.sort(vkey[edge], axis=1), axis=0,
+                            return_inverse=True)
+    ekey = ekey.ravel()
+    collapse = np.zeros(len(cedge), dtype=bool)
+    collapse[ekey[short]] = True
+    while True:
+        chosen = cedge[collapse]
+        graph = sp_sparse.coo_matrix(
+            (np.ones(len(chosen)), (chosen[:, 0], chosen[:, 1])),
+            shape=(nkey, nkey))
+        ngroup, group = connected_components(graph, directed=False)
+        # unwrap groups around their first vertex, groups are small
+        rep = np.zeros(ngroup, dtype=int)
+        rep[group[::-1]] = np.arange(nkey)[::-1]
+        rel = wrapped - wrapped[rep[group]]
+        unwrapped = wrapped[rep[group]] + rel - domain * np.round(
+            rel / domain)
+        centroid = np.stack(
+            [np.bincount(group, unwrapped[:, k]) for k in range(3)],
+            axis=1) / np.bincount(group)[:, np.newaxis]
+        # copies of the group in the same periodic image are merged
+        image = np.round((vert - unwrapped[vkey]) / domain).astype(int)
+        merged, merge = np.unique(
+            np.column_stack((group[vkey], image)), axis=0,
+            return_inverse=True)
+        vertex = centroid[merged[:, 0]] + domain * merged[:, 1:]
+        out, pinched = _collapse(tess, merge.ravel(), vertex)
+        if not np.any(pinched):
+            return out
+        # do not merge groups of vertices in pinched faces
+        fptr = tess['face_ptr']
+        bad = np.unique(group[vkey[tess['face_vertex'][
+            np.repeat(pinched, np.diff(fptr))]]])
+        collapse &= ~np.isin(group[cedge[:, 0]], bad)
+
+
+def regularize_tessellation(fname, edge_fraction, area_fraction=0.0,
+                            rve_size=1):
+    """Regularize tessellation.
+
+    Tessellation is read by :func:`read_tessellation` and regularized by
+    :func:`regularize`, i.e., it is recomputed by the native engine from
+    seeds with changed weights. Thresholds are relative to mean cell size.
+    Creates ``*Tessellation.npz`` and ``*Tessellation.geo`` files as
+    :func:`native_tessellation`.
+
+    Args:
+        fname (str): base filename
+        edge_fraction (float): minimum edge length relative to mean cell size
+        area_fraction (float, optional): minimum face area relative to
+            square of mean cell size
+        rve_size (float, optional): domain size
+
+    Returns:
+        dict: regularized tessellation
+    """
+    tess = read_tessellation(fname)
+    size = rve_size * (len(tess['cell_ptr']) - 1)**(-1 / 3)
+    nedge = len(tess['edge'])
+    tess = regularize(tess, edge_fraction * size, area_fraction * size**2,
+                      rve_size)
+    print('Regularization removed {} of {} edges.'.format(
+        nedge - len(tess['edge']), nedge))
+    np.savez(fname + 'Tessellation.npz', **tess)
+    save_geo(fname + 'Tessellation.geo', collect_strings(to_edat(tess)),
+             opencascade=False)
+    return tess
+
+
+def native_tessellation(fname, rve_size=1):
+    """Run native Laguerre tessellation.
+
+    Alternative to :func:`neper_tessellation`, which does not need external
+    program. Packing is read by :func:`foamgen.packing.read_packing`. Creates
+    ``*Tessellation.geo`` file compatible with Neper output and
+    ``*Tessellation.npz`` file with tessellation arrays.
+
+    Args:
+        fname (str): base filename
+        rve_size (float, optional): domain size
+
+    Returns:
+        dict: tessellation, see :func:`laguerre_tessellation`
+    """
+    dtf = read_packing(fname)
+    tess = laguerre_tessellation(dtf[['x', 'y', 'z']].values,
+                                 dtf['d'].values / 2, rve_size)
+    np.savez(fname + 'Tessellation.npz', **tess)
+    save_geo(fname + 'Tessellation.geo', collect_strings(to_edat(tess)),
+             opencascade=False)
+    return tess
+
+
+def _tess_sections(text):
+    """Split Neper ``.tess`` file to sections.
+
+    Args:
+        text (str): content of the file
+
+    Returns:
+        dict: body of each section (``**name``) as text
+    """
+    parts = re.split(r'\s\*\*(\w+)', text)
+    return dict(zip(parts[1::2], parts[2::2]))
+
+
+def _tess_lines(body):
+    """Tokenize section of Neper ``.tess`` file by lines.
+
+    Args:
+        body (str): body of the section
+
+    Returns:
+        tuple: numbers of the section, position of the first number of each
+        non-empty line and count of numbers on the line
+    """
+    text = np.frombuffer(body.encode(), dtype=np.uint8)
+    space = np.isin(text, np.frombuffer(b' \t\r\n', dtype=np.uint8))
+    # first character of each number and line containing it
+    first = np.flatnonzero(~space & np.concatenate(([True], space[:-1])))
+    line = np.searchsorted(np.flatnonzero(text == ord('\n')), first)
+    _, start, length = np.unique(line, return_index=True, return_counts=True)
+    return np.array(body.split(), dtype=float), start, length
+
+
+def _gather(tokens, start, length):
+    """Gather variable length lists from tokens.
+
+    Args:
+        tokens (ndarray): numbers of the section
+        start (ndarray): position of the first item of each list
+        length (ndarray): length of each list
+
+    Returns:
+        tuple: list items (integers) and pointers to the start of each list
+    """
+    ptr = np.concatenate(([0], np.cumsum(length)))
+    index = np.repeat(start - ptr[:-1], length) + np.arange(ptr[-1])
+    return tokens[index].astype(int), ptr
+
+
+def tessellation_file(fname, fmt=None):
+    """Find file with tessellation.
+
+    By default, ``*Tessellation.npz`` file (native or regularized
+    tessellation) is used if it exists, ``*Tessellation.tess`` file
+    otherwise. :func:`tessellate` removes stale ``*Tessellation.npz`` file,
+    when it creates Neper tessellation without regularization.
+
+    Args:
+        fname (str): base filename
+        fmt (str, optional): format of tessellation file (``tess`` or
+            ``npz``)
+
+    Returns:
+        str: ``*Tessellation.tess`` or ``*Tessellation.npz`` file
+
+    Raises:
+        Exception: when tessellation file does not exist
+    """
+    if fmt is None:
+        fmt = 'npz' if os.path.isfile(fname + 'Tessellation.npz') else 'tess'
+    fil = fname + 'Tessellation.' + fmt
+    if not os.path.isfile(fil):
+        raise Exception('Tessellation file {} not found.'.format(fil))
+    return fil
+
+
+def read_tessellation(fname, fmt=None):
+    """Read tessellation to arrays.
+
+    Reads ``*Tessellation.tess`` file created by Neper and statistics files
+    (``*Tessellation.stcell``, ``*Tessellation.stface`` and
+    ``*Tessellation.stedge``) or ``*Tessellation.npz`` file created by
+    :func:`native_tessellation`, see :func:`tessellation_file`. Sections of
+    ``.tess`` file are tokenized by lines, variable length lists of faces and
+    cells are then gathered using their positions.
+
+    Arrays are described in :func:`laguerre_tessellation`. Keys
+    ``face_cell`` and ``face_shift`` are available only for native
+    tessellation. Statistics read from Neper files are stored under keys
+    ``cell_volume``, ``face_area`` and ``edge_length``.
+
+    Args:
+        fname (str): base filename
+        fmt (str, optional): format of tessellation file, see
+            :func:`tessellation_file`
+
+    Returns:
+        dict: tessellation
+
+    Raises:
+        Exception: when tessellation file does not exist
+    """
+    fil = tessellation_file(fname, fmt)
+    if fil.endswith('.npz'):
+        with np.load(fil) as fin:
+            return dict(fin)
+    with open(fil, 'r') as fin:
+        sect = _tess_sections(fin.read())
+    tess = dict()
+    seed = re.search(r'\*seed\s(.*?)(?:\s\*|$)', sect['cell'], re.S)
+    seed = np.array(seed.group(1).split(), dtype=float).reshape(-1, 5)
+    tess['seed'] = seed[:, 1:4]
+    tess['radius'] = seed[:, 4]
+    tokens = np.array(sect['vertex'].split(), dtype=float)
+    tess['vertex'] = tokens[1:].reshape(-1, 5)[:, 1:4]
+    tokens = np.array(sect['edge'].split(), dtype=int)
+    tess['edge'] = tokens[1:].reshape(-1, 4)[:, 1:3] - 1
+    tokens, start, length = _tess_lines(sect['face'])
+    # lines of each face: id and vertices, edges, equation, state and point
+    verts, tess['face_ptr'] = _gather(tokens, start[1::4] + 2,
+                                      length[1::4] - 2)
+    edges, _ = _gather(tokens, start[2::4] + 1, length[2::4] - 1)
+    tess['face_vertex'] = verts - 1
+    tess['face_edge'] = np.abs(edges) - 1
+    tess['face_sign'] = np.sign(edges)
+    tokens, start, length = _tess_lines(sect['polyhedron'])
+    # line of each cell: id and faces
+    faces, tess['cell_ptr'] = _gather(tokens, start[1:] + 2, length[1:] - 2)
+    tess['cell_face'] = np.abs(faces) - 1
+    tess['cell_sign'] = np.sign(faces)
+    for key, ext in (('cell_volume', 'stcell'), ('face_area', 'stface'),
+                     ('edge_length', 'stedge')):
+        stat = '{}Tessellation.{}'.format(fname, ext)
+        if os.path.isfile(stat):
+            tess[key] = np.loadtxt(stat, ndmin=1)
+    return tess
+
+
+def face_geometry(tess):
+    """Compute centroids and vector areas of faces.
+
+    Vector area is the sum of vector areas of triangles connecting vertex
+    centroid with consecutive vertices of the face. Its norm is the area of
+    the face and its direction is the face normal.
+
+    Args:
+        tess (dict): tessellation, see :func:`laguerre_tessellation`
+
+    Returns:
+        tuple: vertex centroids and vector areas of faces
+    """
+    ptr, verts = tess['face_ptr'], tess['face_vertex']
+    count = np.diff(ptr)
+    face = np.repeat(np.arange(len(count)), count)
+    pts = tess['vertex'][verts]
+    centroid = np.stack([np.bincount(face, pts[:, k], minlength=len(count))
+                         for k in range(3)], axis=1) / count[:, np.newaxis]
+    nxt = np.arange(len(verts)) + 1
+    nxt[ptr[1:] - 1] = ptr[:-1]
+    rel = pts - centroid[face]
+    tri = np.cross(rel, rel[nxt]) / 2
+    area = np.stack([np.bincount(face, tri[:, k], minlength=len(count))
+                     for k in range(3)], axis=1)
+    return centroid, area
+
+
+def cell_statistics(tess):
+    """Compute geometric statistics of cells.
+
+    Volumes are computed from divergence theorem over faces of the cell,
+    which need to form closed polyhedron. Neighbors are cells sharing a face
+    with the cell. Without ``face_cell`` (Neper tessellation), face bounding
+    only one cell counts as one neighbor (periodic image of another cell).
+
+    Args:
+        tess (dict): tessellation, see :func:`laguerre_tessellation`
+
+    Returns:
+        DataFrame: ``volume``, ``area``, ``faces``, ``neighbors`` and
+        ``sphericity`` of each cell
+    """
+    centroid, area = face_geometry(tess)
+    cptr, cface = tess['cell_ptr'], tess['cell_face']
+    ncell = len(cptr) - 1
+    nface = np.diff(cptr)
+    cell = np.repeat(np.arange(ncell), nface)
+    # origin inside each cell reduces round-off error
+    origin = np.stack([np.bincount(cell, centroid[cface, k], minlength=ncell)
+                       for k in range(3)], axis=1)
+    origin /= np.maximum(nface, 1)[:, np.newaxis]
+    flux = tess['cell_sign'] * np.sum(
+        (centroid[cface] - origin[cell]) * area[cface], axis=1)
+    volume = np.abs(np.bincount(cell, flux, minlength=ncell)) / 3
+    surface = np.bincount(cell, np.linalg.norm(area, axis=1)[cface],
+                          minlength=ncell)
+    if 'face_cell' in tess:
+        pairs = np.concatenate((tess['face_cell'], tess['face_cell'][:, ::-1]))
+        lone = np.zeros(ncell, dtype=int)
+    else:
+        owners = np.bincount(cface, minlength=len(area))
+        shared = owners[cface] == 2
+        order = np.argsort(cface[shared], kind='stable')
+        ends = cell[shared][order].reshape(-1, 2)
+        pairs = np.concatenate((ends, ends[:, ::-1]))
+        lone = np.bincount(cell[~shared], minlength=ncell)
+    pairs = np.unique(pairs[pairs[:, 0] != pairs[:, 1]], axis=0)
+    neighbors = np.bincount(pairs[:, 0], minlength=ncell) + lone
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sphericity = np.pi**(1 / 3) * (6 * volume)**(2 / 3) / surface
+    return pd.DataFrame({
+        'volume': volume,
+        'area': surface,
+        'faces': nface,
+        'neighbors': neighbors,
+        'sphericity': sphericity,
+    })
+
+
+def validate_tessellation(tess, domain=1.0, min_edge=None, tol=1e-6):
+    """Check tessellation before it is used by following stages.
+
+    Following problems are counted (see ``VALIDATION_PROBLEMS``):
+
+    * ``unpaired_faces`` -- faces bounding only one cell without periodic
+      image bounding another cell
+    * ``open_cells`` -- cells with edge not shared by exactly two faces
+    * ``volume_mismatch`` -- 1 if relative difference of total volume of
+      cells and domain volume exceeds ``tol``, 0 otherwise
+
+    Following properties, which Laguerre tessellations naturally have, are
+    counted as well (see ``VALIDATION_WARNINGS``). They complicate meshing,
+    but do not make tessellation invalid, see :func:`regularize`:
+
+    * ``short_edges`` -- edges shorter than ``min_edge``
+    * ``degenerate_faces`` -- faces with area smaller than ``min_edge**2``
+    * ``nonplanar_faces`` -- faces with vertex farther than ``tol`` from
+      face plane
+
+    Args:
+        tess (dict): tessellation, see :func:`laguerre_tessellation`
+        domain (float, optional): size of periodic domain
+        min_edge (float, optional): minimum edge length, 1e-4 of mean cell
+            size by default
+        tol (float, optional): tolerance relative to domain size
+
+    Returns:
+        dict: number of each problem, ``min_edge`` (shortest edge),
+        ``planarity`` (maximum distance of vertex from face plane),
+        ``volume_error`` (relative difference of total volume of cells and
+        domain volume) and ``empty_cells`` (seeds without cell)
+    """
+    vert = tess['vertex']
+    fptr, cptr = tess['face_ptr'], tess['cell_ptr']
+    cface = tess['cell_face']
+    ncell = len(cptr) - 1
+    nface = len(fptr) - 1
+    if min_edge is None:
+        min_edge = 1e-4 * domain * ncell**(-1 / 3)
+    tol *= domain
+    length = np.linalg.norm(
+        vert[tess['edge'][:, 1]] - vert[tess['edge'][:, 0]], axis=1)
+    centroid, area = face_geometry(tess)
+    norm = np.linalg.norm(area, axis=1)
+    normal = area / np.maximum(norm, np.finfo(float).tiny)[:, np.newaxis]
+    face = np.repeat(np.arange(nface), np.diff(fptr))
+    dist = np.abs(np.sum((vert[tess['face_vertex']] - centroid[face])
+                         * normal[face], axis=1))
+    planarity = np.zeros(nface)
+    np.maximum.at(planarity, face, dist)
+    # faces bounding one cell must have periodic image bounding another one
+    owners = np.bincount(cface, minlength=nface)
+    lone = np.flatnonzero(owners == 1)
+    unpaired = len(lone)
+    if len(lone) > 1:
+        tree = cKDTree(np.mod(centroid[lone], domain), boxsize=domain)
+        dist, near = tree.query(np.mod(centroid[lone], domain), k=2)
+        paired = ((dist[:, 1] < tol)
+                  & (np.abs(norm[lone] - norm[lone[near[:, 1]]])
+                     < tol * domain))
+        unpaired = int(np.count_nonzero(~paired))
+    # each edge of closed cell is shared by two of its faces
+    count = np.diff(fptr)
+    edges, eptr = _gather(tess['face_edge'], fptr[cface], count[cface])
+    cell = np.repeat(np.repeat(np.arange(ncell), np.diff(cptr)),
+                     np.diff(eptr))
+    key = np.sort(cell * len(length) + edges)
+    start = np.flatnonzero(np.diff(key, prepend=-1) != 0)
+    uses = np.diff(np.append(start, len(key)))
+    open_cells = len(np.unique(key[start[uses != 2]] // len(length)))
+    volume_error = abs(cell_statistics(tess)['volume'].sum() / domain**3 - 1)
+    return {
+        'min_edge': float(length.min()) if len(length) else 0.0,
+        'planarity': float(planarity.max()) if nface else 0.0,
+        'short_edges': int(np.count_nonzero(length < min_edge)),
+        'degenerate_faces': int(np.count_nonzero(norm < min_edge**2)),
+        'nonplanar_faces': int(np.count_nonzero(planarity > tol)),
+        'unpaired_faces': unpaired,
+        'open_cells': open_cells,
+        'volume_mismatch': int(volume_error > tol / domain),
+        'volume_error': float(volume_error),
+        'empty_cells': int(np.count_nonzero(np.diff(cptr) == 0)),
+    }
+
+
+def stats(fname, fmt=None):
+    """Get geometric statistics of cells of tessellation.
+
+    Statistics are computed by :func:`cell_statistics` and cached in
+    ``*TessellationStats.npz`` file. Cache is keyed by SHA-256 hash of the
+    content of tessellation file (see :func:`tessellation_file`) and
+    ``STATS_VERSION``, thus statistics are recomputed only when the
+    tessellation changes.
+
+    Args:
+        fname (str): base filename
+        fmt (str, optional): format of tessellation file, see
+            :func:`tessellation_file`
+
+    Returns:
+        DataFrame: ``volume``, ``area``, ``faces``, ``neighbors`` and
+        ``sphericity`` of each cell
+    """
+    fil = tessellation_file(fname, fmt)
+    digest = hashlib.sha256(str(STATS_VERSION).encode())
+    with open(fil, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b''):
+            digest.update(chunk)
+    key = digest.hexdigest()
+    cache = fname + 'TessellationStats.npz'
+    try:
+        with np.load(cache) as fin:
+            if str(fin['key']) == key:
+                return pd.DataFrame({col: fin[col] for col in STATS_COLUMNS})
+    except (IOError, KeyError, ValueError):
+        pass
+    data = cell_statistics(read_tessellation(fname, fmt))
+    # write under temporary name, so that concurrent readers never see
+    # incomplete file
+    tmp = '{}.{}.tmp.npz'.format(cache[:-4], os.getpid())
+    np.savez(tmp, key=key, **{col: data[col].values for col in STATS_COLUMNS})
+    os.replace(tmp, cache)
+    return data
+
+
 def neper_visualize(fname):
     """Run Neper visualization module.
 
@@ -89,43 +1088,130 @@ def neper_visualize(fname):
     command = "neper -V {0}Tessellation.tess -datacellcol ori \
         -datacelltrs 0.5 -showseed all -dataseedrad @rads.txt \
         -dataseedtrs 1.0 -print {0}Tessellation".format(fname)
-    sp.Popen(sx.split(command))
+    sp.Popen(sx.split(command)).wait()
 
 
 def save_gnuplot(fname):
     """Save tessellation in gnuplot format.
 
-    Requires ``*Tessellation.tess`` file. Creates ``*Tessellation.gnu`` file.
+    Requires ``*Tessellation.tess`` or ``*Tessellation.npz`` file, see
+    :func:`read_tessellation`. Creates ``*Tessellation.gnu`` file.
+
+    Args:
+        fname (str): base filename
+    """
+    tess = read_tessellation(fname)
+    ends = tess['vertex'][tess['edge']].reshape(-1, 6)
+    np.savetxt('{0}Tessellation.gnu'.format(fname), ends,
+               fmt='%.17g %.17g %.17g\n%.17g %.17g %.17g\n\n')
+
+
+def save_skeleton(fname, domain=1.0, tol=1e-9):
+    """Save skeleton of tessellation in binary format.
+
+    Skeleton is read by ``foamreconstr``. Edges crossing the domain boundary
+    are mirrored over the domain, so that each of their vertices has one copy
+    inside the domain, and vertices are merged by hashing their coordinates
+    quantized to ``tol``. File contains magic string ``FGSKEL01``, numbers of
+    vertices and edges (int32), vertex coordinates relative to domain size
+    (float64), periodic image shifts of vertices (int32) and vertex indices
+    of edges (int32).
+
+    Requires ``*Tessellation.tess`` or ``*Tessellation.npz`` file, see
+    :func:`read_tessellation`. Creates ``*Tessellation.skel`` file.
 
     Args:
         fname (str): base filename
+        domain (float, optional): size of periodic domain
+        tol (float, optional): tolerance for merging of vertices
+    """
+    tess = read_tessellation(fname)
+    ends = tess['vertex'][tess['edge']]
+    # each edge is moved to images bringing either of its ends to the domain
+    shift = -np.floor(ends / domain) * domain
+    copies = ends[:, np.newaxis] + shift[:, :, np.newaxis]
+    copies = copies.reshape(-1, 2, 3)
+    _, keep = np.unique(np.round(copies / tol).astype(np.int64).reshape(
+        -1, 6), axis=0, return_index=True)
+    copies = copies[np.sort(keep)]
+    keys = np.round(copies.reshape(-1, 3) / tol).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True,
+                                  return_inverse=True)
+    vertex = copies.reshape(-1, 3)[first]
+    edge = np.sort(inverse.reshape(-1, 2), axis=1)
+    edge = np.unique(edge[edge[:, 0] != edge[:, 1]], axis=0)
+    with open('{0}Tessellation.skel'.format(fname), 'wb') as fhl:
+        fhl.write(SKELETON_MAGIC)
+        np.array([len(vertex), len(edge)], dtype='<i4').tofile(fhl)
+        (vertex / domain).astype('<f8').tofile(fhl)
+        np.floor(vertex / domain).astype('<i4').tofile(fhl)
+        edge.astype('<i4').tofile(fhl)
+
+
+def read_skeleton(fname):
+    """Read skeleton of tessellation in binary format.
+
+    Reads ``*Tessellation.skel`` file, see :func:`save_skeleton`.
+
+    Args:
+        fname (str): base filename
+
+    Returns:
+        tuple: vertex coordinates relative to domain size, periodic image
+        shifts and edges
+
+    Raises:
+        Exception: when file is not a skeleton
+    """
+    with open('{0}Tessellation.skel'.format(fname), 'rb') as fhl:
+        if fhl.read(len(SKELETON_MAGIC)) != SKELETON_MAGIC:
+            raise Exception('Unknown format of skeleton file.')
+        nvert, nedge = np.fromfile(fhl, dtype='<i4', count=2)
+        vertex = np.fromfile(fhl, dtype='<f8', count=3 * nvert)
+        shift = np.fromfile(fhl, dtype='<i4', count=3 * nvert)
+        edge = np.fromfile(fhl, dtype='<i4', count=2 * nedge)
+    return vertex.reshape(-1, 3), shift.reshape(-1, 3), edge.reshape(-1, 2)
+
+
+def triangulate(tess):
+    """Triangulate faces of tessellation.
+
+    Faces are planar convex polygons, thus fan triangulation from the first
+    vertex of each face is exact.
+
+    Args:
+        tess (dict): tessellation, see :func:`laguerre_tessellation`
+
+    Returns:
+        ndarray: vertex indices of triangles
     """
-    sdat = read_geo(fname + "Tessellation.geo")
-    edat = extract_data(sdat)
-    point = edat["point"]
-    line = edat["line"]
-    with open('{0}Tessellation.gnu'.format(fname), 'w') as flp:
-        for pidx in line.values():
-            flp.write('{0} {1} {2}\n'.format(
-                point[pidx[0]][0], point[pidx[0]][1], point[pidx[0]][2]))
-            flp.write('{0} {1} {2}\n\n\n'.format(
-                point[pidx[1]][0], point[pidx[1]][1], point[pidx[1]][2]))
+    ptr, verts = tess['face_ptr'], tess['face_vertex']
+    count = np.diff(ptr) - 2
+    first = np.repeat(ptr[:-1], count)
+    second = first + np.arange(len(first)) - np.repeat(
+        np.cumsum(count) - count, count) + 1
+    return np.column_stack((verts[first], verts[second], verts[second + 1]))
 
 
 def periodic_box(fname, dsize, render):
-    """Uses gmsh and vtk to move closed foam to periodic box.
+    """Move closed foam to periodic box.
 
-    Requires ``*Tessellation.geo`` file. Creates ``*TessellationBox.stl`` file.
+    Requires ``*Tessellation.tess`` or ``*Tessellation.npz`` file, see
+    :func:`read_tessellation`. Faces are triangulated by :func:`triangulate`
+    and moved to the box in memory by
+    :func:`foamgen.vtk_tools.surface_to_periodic_box`. Creates
+    ``*TessellationBox.stl`` file.
 
     Args:
         fname (str): base filename
         dsize (float): box size
         render (bool): render scene if True
     """
-    geo_to_stl(fname + "Tessellation.geo")
-    vtk_tools.stl_to_periodic_box(
-        fname + "Tessellation.stl", fname + "TessellationBox.stl", [0, 0, 0],
-        [dsize, dsize, dsize], render
+    tess = read_tessellation(fname)
+    print("Moving tessellation to periodic box.")
+    vtk_tools.surface_to_periodic_box(
+        tess['vertex'][triangulate(tess)], fname + "TessellationBox.stl",
+        [0, 0, 0], [dsize, dsize, dsize], render
     )
 
 
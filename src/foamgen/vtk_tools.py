@@ -5,8 +5,14 @@ VTK support module
 
 .. moduleauthor:: Pavel Ferkl <pavel.ferkl@gmail.com>
 """
+import os
+import re
 from pathlib import Path
+import numpy as np
 import vtk
+# record of binary STL file
+STL_TRIANGLE = np.dtype([('normal', '<f4', 3), ('vertex', '<f4', (3, 3)),
+                         ('attribute', '<u2')])
 
 
 def vtk_bin_to_ascii(fin, fout, origin, spacing):
@@ -36,177 +42,209 @@ def vtk_bin_to_ascii(fin, fout, origin, spacing):
     writer.Write()
 
 
+def save_stl(fout, points, triangles):
+    """Save triangulated surface to binary STL file.
+
+    Args:
+        fout (str): output filename
+        points (ndarray): point coordinates
+        triangles (ndarray): point indices of triangles
+    """
+    corners = points[triangles]
+    normal = np.cross(corners[:, 1] - corners[:, 0],
+                      corners[:, 2] - corners[:, 0])
+    length = np.linalg.norm(normal, axis=1)
+    normal /= np.where(length > 0, length, 1)[:, np.newaxis]
+    data = np.zeros(len(triangles), dtype=STL_TRIANGLE)
+    data['normal'] = normal
+    data['vertex'] = corners
+    with open(fout, 'wb') as fhl:
+        fhl.write(b'binary STL created by foamgen'.ljust(80, b' '))
+        np.array(len(data), dtype='<u4').tofile(fhl)
+        data.tofile(fhl)
+
+
+def read_stl(fin):
+    """Read triangulated surface from binary or ASCII STL file.
+
+    Args:
+        fin (str): input filename
+
+    Returns:
+        ndarray: corner coordinates of each triangle
+    """
+    with open(fin, 'rb') as fhl:
+        head = fhl.read(84)
+        count = int(np.frombuffer(head[80:84], dtype='<u4')[0]) if len(
+            head) == 84 else -1
+        if os.path.getsize(fin) == 84 + STL_TRIANGLE.itemsize * count:
+            data = np.fromfile(fhl, dtype=STL_TRIANGLE, count=count)
+            return data['vertex'].astype(float)
+    with open(fin, 'r') as fhl:
+        text = fhl.read()
+    coords = re.findall(r'vertex\s+(\S+)\s+(\S+)\s+(\S+)', text)
+    return np.array(coords, dtype=float).reshape(-1, 3, 3)
+
+
+def save_ply(fout, points, triangles):
+    """Save triangulated surface to binary PLY file.
+
+    Args:
+        fout (str): output filename
+        points (ndarray): point coordinates
+        triangles (ndarray): point indices of triangles
+    """
+    faces = np.zeros(len(triangles), dtype=[('count', 'u1'),
+                                            ('index', '<i4', 3)])
+    faces['count'] = 3
+    faces['index'] = triangles
+    header = '\n'.join([
+        'ply',
+        'format binary_little_endian 1.0',
+        'element vertex {}'.format(len(points)),
+        'property float x',
+        'property float y',
+        'property float z',
+        'element face {}'.format(len(triangles)),
+        'property list uchar int vertex_indices',
+        'end_header',
+    ]) + '\n'
+    with open(fout, 'wb') as fhl:
+        fhl.write(header.encode('ascii'))
+        np.asarray(points, dtype='<f4').tofile(fhl)
+        faces.tofile(fhl)
+
+
+def split_triangles(corners, axis, coord, eps=1e-12):
+    """Split triangles crossing a plane.
+
+    Plane is normal to one of cartesian axes. Each crossing triangle is
+    split into three triangles with the same orientation, none of which
+    crosses the plane.
+
+    Args:
+        corners (ndarray): corner coordinates of each triangle
+        axis (int): order of coordinate axis
+        coord (float): point on the chosen axis
+        eps (float, optional): tolerance
+
+    Returns:
+        ndarray: corner coordinates of each triangle
+    """
+    dist = corners[:, :, axis] - coord
+    side = dist > eps
+    cross = np.any(side, axis=1) & np.any(dist < -eps, axis=1)
+    if not np.any(cross):
+        return corners
+    tri, dist, side = corners[cross], dist[cross], side[cross]
+    # rotate corners, so that the lone corner on its side is the first one
+    lone = np.where(np.sum(side, axis=1) == 1, np.argmax(side, axis=1),
+                    np.argmin(side, axis=1))
+    order = (lone[:, np.newaxis] + np.arange(3)) % 3
+    tri = np.take_along_axis(tri, order[:, :, np.newaxis], axis=1)
+    dist = np.take_along_axis(dist, order, axis=1)
+    first, second, third = tri[:, 0], tri[:, 1], tri[:, 2]
+    frac = dist[:, :1] / (dist[:, :1] - dist[:, 1:])
+    pab = first + frac[:, :1] * (second - first)
+    pac = first + frac[:, 1:] * (third - first)
+    pieces = np.concatenate((
+        np.stack((first, pab, pac), axis=1),
+        np.stack((pab, second, third), axis=1),
+        np.stack((pab, third, pac), axis=1),
+    ))
+    return np.concatenate((corners[~cross], pieces))
+
+
+def merge_points(corners, tol=1e-9):
+    """Merge duplicate points of triangulated surface.
+
+    Points are hashed by their coordinates quantized to ``tol``. Degenerate
+    triangles are removed.
+
+    Args:
+        corners (ndarray): corner coordinates of each triangle
+        tol (float, optional): quantization step
+
+    Returns:
+        tuple: point coordinates and point indices of triangles
+    """
+    coords = corners.reshape(-1, 3)
+    keys = np.round(coords / tol).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True,
+                                  return_inverse=True)
+    triangles = inverse.reshape(-1, 3)
+    valid = ((triangles[:, 0] != triangles[:, 1])
+             & (triangles[:, 1] != triangles[:, 2])
+             & (triangles[:, 2] != triangles[:, 0]))
+    return coords[first], triangles[valid]
+
+
 def stl_to_periodic_box(fin, fout, mins, sizes, render):
     """Move periodic STL into periodic box.
 
-    Uses VTK to create foam in box with periodic boundary conditions.
-    Divides the foam to 27 parts and reflects them over boundaries.
+    STL file is read by :func:`read_stl` and moved to the box by
+    :func:`surface_to_periodic_box`.
 
     Args:
         fin (str): filename of foam with all closed cells
-        fout (str): filename of foam fully inside the box
+        fout (str): filename of foam fully inside the box (STL or PLY)
         mins (list): origin coordinates
         sizes (list): box sizes
         render (bool): render scene if True
     """
     print("Moving STL to periodic box.")
-    xmin, ymin, zmin = mins
-    dx, dy, dz = sizes
-    # print vtk.VTK_MAJOR_VERSION # Check the version
-    # Read the file and create polydata
-    reader = vtk.vtkSTLReader()
-    reader.SetFileName(fin)
-    # Define planes for clipping
-    origins = [
-        [xmin, ymin, zmin],
-        [xmin, ymin, zmin],
-        [xmin, ymin, zmin],
-        [xmin+dx, ymin+dy, zmin+dz],
-        [xmin+dx, ymin+dy, zmin+dz],
-        [xmin+dx, ymin+dy, zmin+dz],
-    ]
-    normals = [
-        [[-1, 0, 0], [0, -1, 0], [0, 0, -1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, -1, 0], [0, 0, -1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, -1, 0], [0, 0, -1], [+1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[-1, 0, 0], [0, +1, 0], [0, 0, -1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, -1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, -1], [+1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[-1, 0, 0], [0, +1, 0], [0, 0, -1], [-1, 0, 0], [0, +1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, -1], [-1, 0, 0], [0, +1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, -1], [+1, 0, 0], [0, +1, 0], [0, 0, -1]],
-
-        [[-1, 0, 0], [0, -1, 0], [0, 0, +1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, -1, 0], [0, 0, +1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, -1, 0], [0, 0, +1], [+1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[-1, 0, 0], [0, +1, 0], [0, 0, +1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, +1], [-1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, +1], [+1, 0, 0], [0, -1, 0], [0, 0, -1]],
-        [[-1, 0, 0], [0, +1, 0], [0, 0, +1], [-1, 0, 0], [0, +1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, +1], [-1, 0, 0], [0, +1, 0], [0, 0, -1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, +1], [+1, 0, 0], [0, +1, 0], [0, 0, -1]],
-
-        [[-1, 0, 0], [0, -1, 0], [0, 0, +1], [-1, 0, 0], [0, -1, 0], [0, 0, +1]],
-        [[+1, 0, 0], [0, -1, 0], [0, 0, +1], [-1, 0, 0], [0, -1, 0], [0, 0, +1]],
-        [[+1, 0, 0], [0, -1, 0], [0, 0, +1], [+1, 0, 0], [0, -1, 0], [0, 0, +1]],
-        [[-1, 0, 0], [0, +1, 0], [0, 0, +1], [-1, 0, 0], [0, -1, 0], [0, 0, +1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, +1], [-1, 0, 0], [0, -1, 0], [0, 0, +1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, +1], [+1, 0, 0], [0, -1, 0], [0, 0, +1]],
-        [[-1, 0, 0], [0, +1, 0], [0, 0, +1], [-1, 0, 0], [0, +1, 0], [0, 0, +1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, +1], [-1, 0, 0], [0, +1, 0], [0, 0, +1]],
-        [[+1, 0, 0], [0, +1, 0], [0, 0, +1], [+1, 0, 0], [0, +1, 0], [0, 0, +1]],
-    ]
-    # Define directions for moving clipped regions
-    direction = [
-        [dx, dy, dz],
-        [0, dy, dz],
-        [-dx, dy, dz],
-        [dx, 0, dz],
-        [0, 0, dz],
-        [-dx, 0, dz],
-        [dx, -dy, dz],
-        [0, -dy, dz],
-        [-dx, -dy, dz],
-        [dx, dy, 0],
-        [0, dy, 0],
-        [-dx, dy, 0],
-        [dx, 0, 0],
-        [0, 0, 0],
-        [-dx, 0, 0],
-        [dx, -dy, 0],
-        [0, -dy, 0],
-        [-dx, -dy, 0],
-        [dx, dy, -dz],
-        [0, dy, -dz],
-        [-dx, dy, -dz],
-        [dx, 0, -dz],
-        [0, 0, -dz],
-        [-dx, 0, -dz],
-        [dx, -dy, -dz],
-        [0, -dy, -dz],
-        [-dx, -dy, -dz],
-    ]
-    regions = []
-    n = 27
-    for j in range(n):
-        polydata = reader
-        # Clip it with all 6 planes
-        for i in range(6):
-            plane = vtk.vtkPlane()
-            plane.SetOrigin(origins[i])
-            plane.SetNormal(normals[j][i])
-            clipper = vtk.vtkClipPolyData()
-            clipper.SetInputConnection(polydata.GetOutputPort())
-            clipper.SetClipFunction(plane)
-            polydata = clipper
-            polydata.Update()
-        # Move it if not empty
-        if polydata.GetOutput().GetLength() > 0:
-            transform = vtk.vtkTransform()
-            transform.Translate(direction[j])
-            transformFilter = vtk.vtkTransformPolyDataFilter()
-            transformFilter.SetTransform(transform)
-            transformFilter.SetInputConnection(polydata.GetOutputPort())
-            transformFilter.Update()
-            regions.append(vtk.vtkPolyData())
-            regions[j].ShallowCopy(transformFilter.GetOutput())
-        else:
-            regions.append(vtk.vtkPolyData())
-            regions[j].ShallowCopy(polydata.GetOutput())
-    # Append the all regions
-    append_filter = vtk.vtkAppendPolyData()
-    if vtk.VTK_MAJOR_VERSION <= 5:
-        for j in range(n):
-            append_filter.AddInputConnection(regions[j].GetProducerPort())
-    else:
-        for j in range(n):
-            append_filter.AddInputData(regions[j])
-    append_filter.Update()
-    #  Remove any duplicate points
-    clean_filter = vtk.vtkCleanPolyData()
-    clean_filter.SetInputConnection(append_filter.GetOutputPort())
-    clean_filter.Update()
-    # One more rotation - not needed
-    # transform = vtk.vtkTransform()
-    # transform.Translate(-6,-6,-6)
-    # transformFilter = vtk.vtkTransformPolyDataFilter()
-    # transformFilter.SetTransform(transform)
-    # transformFilter.SetInputConnection(clean_filter.GetOutputPort())
-    # transformFilter.Update()
-    # transform = vtk.vtkTransform()
-    # transform.RotateWXYZ(90,1,0,0)
-    # transform.RotateWXYZ(-90,0,1,0)
-    # transformFilter2 = vtk.vtkTransformPolyDataFilter()
-    # transformFilter2.SetTransform(transform)
-    # transformFilter2.SetInputConnection(transformFilter.GetOutputPort())
-    # transformFilter2.Update()
-    # transform = vtk.vtkTransform()
-    # transform.Translate(6,6,6)
-    # transformFilter = vtk.vtkTransformPolyDataFilter()
-    # transformFilter.SetTransform(transform)
-    # transformFilter.SetInputConnection(transformFilter2.GetOutputPort())
-    # transformFilter.Update()
-    # Final data to be saved and displayed
-    final_data = clean_filter
-    # Write the file to disk
-    ext = Path(fout).suffix[1:]
-    if ext.lower() == 'stl':
-        writer = vtk.vtkSTLWriter()
-    elif ext.lower() == 'ply':
-        writer = vtk.vtkPLYWriter()
-    else:
+    surface_to_periodic_box(read_stl(fin), fout, mins, sizes, render)
+
+
+def surface_to_periodic_box(corners, fout, mins, sizes, render):
+    """Move periodic triangulated surface into periodic box.
+
+    Triangles crossing the box boundaries are split by
+    :func:`split_triangles`. Each triangle is then moved by the multiple of
+    box size, which brings it inside the box. Duplicate points are merged by
+    :func:`merge_points`. Triangles inside the box are processed only once.
+
+    Args:
+        corners (ndarray): corner coordinates of each triangle of foam with
+            all closed cells
+        fout (str): filename of foam fully inside the box (STL or PLY)
+        mins (list): origin coordinates
+        sizes (list): box sizes
+        render (bool): render scene if True
+
+    Raises:
+        Exception: when output format is not supported
+    """
+    ext = Path(fout).suffix[1:].lower()
+    if ext not in ('stl', 'ply'):
         print(ext)
         raise Exception('Can write only stl or ply file.')
-    writer.SetFileName(fout)
-    writer.SetInputConnection(final_data.GetOutputPort())
-    writer.Write()
+    mins = np.asarray(mins, dtype=float)
+    sizes = np.asarray(sizes, dtype=float)
+    corners = np.array(corners, dtype=float)
+    eps = 1e-12 * np.max(sizes)
+    for axis in range(3):
+        for coord in (mins[axis], mins[axis] + sizes[axis]):
+            corners = split_triangles(corners, axis, coord, eps)
+    # periodic image containing the centroid of each triangle
+    shift = np.floor((np.mean(corners, axis=1) - mins) / sizes)
+    corners -= (shift * sizes)[:, np.newaxis]
+    points, triangles = merge_points(corners, 1e-9 * np.max(sizes))
+    if ext == 'stl':
+        save_stl(fout, points, triangles)
+    else:
+        save_ply(fout, points, triangles)
     if render:
+        # Read the result back for rendering
+        reader = vtk.vtkSTLReader() if ext == 'stl' else vtk.vtkPLYReader()
+        reader.SetFileName(fout)
+        reader.Update()
         # Create mappper and actor for rendering
         mapper = vtk.vtkPolyDataMapper()
         if vtk.VTK_MAJOR_VERSION <= 5:
-            mapper.SetInput(final_data.GetOutput())
+            mapper.SetInput(reader.GetOutput())
         else:
-            mapper.SetInputConnection(final_data.GetOutputPort())
+            mapper.SetInputConnection(reader.GetOutputPort())
         actor = vtk.vtkActor()
         actor.SetMapper(mapper)
         # Create a rendering window and renderer
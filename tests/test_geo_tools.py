@@ -0,0 +1,73 @@
+"""Tests of :mod:`foamgen.geo_tools`."""
+from foamgen import geo_tools as gt
+
+
+def loops(*items):
+    """Create extracted geometry data with line loops and surfaces."""
+    return {
+        'line_loop': {i: list(item) for i, item in items},
+        'surface': {i: [i] for i, _ in items},
+    }
+
+
+def test_split_loops_multiple_holes():
+    edat = loops((1, range(1, 7)), (2, [2, 3]), (3, [5, 6]))
+    gt.split_loops(edat, 'line_loop')
+    assert edat['line_loop'] == {1: [1, 4], 2: [2, 3], 3: [5, 6]}
+    assert edat['surface'] == {1: [1, 2, 3], 2: [2], 3: [3]}
+
+
+def test_split_loops_duplicate_loops():
+    edat = loops((1, range(1, 7)), (2, [2, 3]), (3, [5, 6]),
+                 (5, range(1, 7)))
+    gt.split_loops(edat, 'line_loop')
+    assert edat['line_loop'][1] == [1, 4]
+    assert edat['line_loop'][5] == [1, 4]
+    assert edat['surface'][1] == [1, 2, 3]
+    assert edat['surface'][5] == [5, 2, 3]
+
+
+def test_split_loops_order():
+    edat = loops((5, range(1, 7)), (3, [5, 6]), (1, range(1, 7)),
+                 (2, [2, 3]))
+    gt.split_loops(edat, 'line_loop')
+    assert edat['line_loop'][1] == [1, 4]
+    assert edat['line_loop'][5] == [1, 4]
+    assert edat['surface'][1] == [1, 3, 2]
+    assert edat['surface'][5] == [5, 3, 2]
+
+
+GEO = """\
+Point (1) = {0, 0, 1e-9, 0.1};
+Point(2)={1.5,0,0};
+Point (3) = {0, 2, 0};
+Line (1) = {1, 2};
+Line (2) = {2, 3};
+Line (3) = {3, 1};
+Line Loop (1) = {1,
+    -2, 3};
+Plane Surface (1) = {1};
+Surface (2) = {1};
+Surface Loop (1) = {1};
+Volume (1) = {1};
+Physical Surface (1) = {1};
+Physical Volume ("cells") = {1};
+"""
+
+
+def test_parse_geo(tmp_path):
+    geo_file = str(tmp_path / 'test.geo')
+    with open(geo_file, 'w') as text_file:
+        text_file.write(GEO)
+    edat = gt.parse_geo(geo_file)
+    ref = gt.extract_data(gt.read_geo(geo_file))
+    points, ref_points = edat.pop('point'), ref.pop('point')
+    assert edat == ref
+    assert {i: list(points[i]) for i in points} == {
+        i: list(ref_points[i]) for i in ref_points} == {
+        1: [0, 0, 0], 2: [1.5, 0, 0], 3: [0, 2, 0]}
+    assert edat['line_loop'] == {1: [1, 2, 3]}
+    assert edat['surface'] == {1: [1]}
+    assert edat['physical_volume'] == {1: [1]}
+    edat = gt.parse_geo(geo_file, plane_surface=False)
+    assert edat['surface'] == {2: [1]}
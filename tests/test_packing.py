@@ -0,0 +1,73 @@
+"""Tests of :mod:`foamgen.packing`."""
+import os
+import numpy as np
+from foamgen import packing as pc
+
+
+def gaps(dtf, domain=1.0):
+    """Compute ratios of center distances and mean diameters of all pairs."""
+    pos = dtf[['x', 'y', 'z']].values
+    diam = dtf['d'].values
+    first, second = np.triu_indices(len(diam), 1)
+    delta = pos[first] - pos[second]
+    delta -= domain * np.round(delta / domain)
+    return np.linalg.norm(delta, axis=1) / (diam[first] + diam[second]) * 2
+
+
+def fraction(dtf, domain=1.0):
+    """Compute volume fraction of spheres."""
+    return np.pi / 6 * np.sum(dtf['d'].values**3) / domain**3
+
+
+def test_simple_packing():
+    np.random.seed(0)
+    diam = np.random.lognormal(0, 0.2, 300)
+    dtf = pc.simple_packing(diam, fraction=0.2, domain=2.0)
+    assert len(dtf) == len(diam)
+    assert np.allclose(np.sort(dtf['d']), np.sort(diam) * dtf['d'].max()
+                       / diam.max())
+    assert np.isclose(fraction(dtf, 2.0), 0.2)
+    assert np.all(gaps(dtf, 2.0) >= 1)
+
+
+def test_cr_packing():
+    np.random.seed(0)
+    diam = np.random.lognormal(0, 0.2, 300)
+    dtf = pc.cr_packing(diam, domain=2.0)
+    assert np.allclose(dtf['d'] / diam, dtf['d'][0] / diam[0])
+    ratio = gaps(dtf, 2.0)
+    assert np.all(ratio >= 1 - 1e-12)
+    # inner diameters are given by the closest pair
+    assert np.isclose(ratio.min(), 1)
+    assert fraction(dtf, 2.0) > 0.55
+
+
+def test_cache_hit(tmp_path):
+    key = pc.cache_key(0.2, 1.0, 50, 'simple', 1)
+    assert pc.load_cached(str(tmp_path), key) is None
+    np.random.seed(0)
+    diam = np.random.lognormal(0, 0.2, 50)
+    dtf = pc.simple_packing(diam)
+    pc.store_cached(str(tmp_path), key, diam, dtf)
+    cached_diam, cached = pc.load_cached(str(tmp_path), key)
+    assert np.array_equal(cached_diam, diam)
+    assert np.array_equal(cached[['x', 'y', 'z', 'd']].values,
+                          dtf[['x', 'y', 'z', 'd']].values)
+    assert pc.cache_key(0.2, 1.0, 50, 'simple', 2) != key
+
+
+def test_cache_eviction(tmp_path):
+    cache = str(tmp_path)
+    diam = np.ones(100)
+    dtf = pc.simple_packing(diam)
+    keys = [pc.cache_key(0, 1.0, 100, 'simple', seed) for seed in range(3)]
+    pc.store_cached(cache, keys[0], diam, dtf)
+    pc.store_cached(cache, keys[1], diam, dtf)
+    # the first packing is older, but it is used recently
+    files = [tmp_path / (key + '.npz') for key in keys]
+    os.utime(files[0], (1, 1))
+    os.utime(files[1], (2, 2))
+    assert pc.load_cached(cache, keys[0]) is not None
+    size = 2.5 * files[0].stat().st_size / 2**20
+    pc.store_cached(cache, keys[2], diam, dtf, size)
+    assert [fil.exists() for fil in files] == [True, False, True]
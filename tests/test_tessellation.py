@@ -0,0 +1,70 @@
+"""Tests of :mod:`foamgen.tessellation`."""
+import numpy as np
+from foamgen import tessellation as tes
+from foamgen.packing import cr_packing
+
+
+def seeds(npart, domain=1.0, seed=0):
+    """Create random seeds with radii of about half of their distance."""
+    rng = np.random.default_rng(seed)
+    centers = rng.random((npart, 3)) * domain
+    rads = rng.uniform(0.1, 0.3, npart) * domain * npart**(-1 / 3)
+    return centers, rads
+
+
+def brute_force(points, centers, rads, domain=1.0):
+    """Find minimum power distance among all periodic images."""
+    delta = points[:, None, :] - centers[None, :, :]
+    delta -= domain * np.round(delta / domain)
+    power = np.sum(delta**2, axis=2) - rads**2
+    return power.argmin(axis=1), power.min(axis=1)
+
+
+def test_laguerre_tessellation():
+    for npart, domain in ((5, 1.0), (200, 2.0)):
+        centers, rads = seeds(npart, domain)
+        tess = tes.laguerre_tessellation(centers, rads, domain)
+        volume = tes.cell_statistics(tess)['volume']
+        assert np.isclose(volume.sum(), domain**3)
+        assert np.all(volume > 0)
+        # face between cell and periodic image of another cell is present in
+        # both cells, other faces are shared
+        owners = np.bincount(tess['cell_face'])
+        assert set(owners) <= {1, 2}
+        centroid, _ = tes.face_geometry(tess)
+        faces = {(i, j) + tuple(shift): face for face, ((i, j), shift) in
+                 enumerate(zip(tess['face_cell'], tess['face_shift']))}
+        for face in np.flatnonzero(owners == 1):
+            (i, j), shift = tess['face_cell'][face], tess['face_shift'][face]
+            pair = faces[(j, i) + tuple(-shift)]
+            assert owners[pair] == 1
+            assert np.allclose(centroid[pair], centroid[face] - domain * shift)
+        report = tes.validate_tessellation(tess, domain)
+        assert not any(report[key] for key in tes.VALIDATION_PROBLEMS)
+
+
+def test_cell_locator_brute_force():
+    for npart, domain in ((5, 1.0), (200, 2.0)):
+        centers, rads = seeds(npart, domain)
+        points = np.random.default_rng(1).random((2000, 3)) * 3 - 1
+        cell, power = tes.CellLocator(centers, rads, domain).query(points)
+        exact_cell, exact_power = brute_force(points, centers, rads, domain)
+        assert np.array_equal(cell, exact_cell)
+        assert np.allclose(power, exact_power)
+
+
+def test_regularize_planar():
+    rng = np.random.default_rng(0)
+    dtf = cr_packing(rng.lognormal(0, 0.2, 200), centers=rng.random((200, 3)))
+    tess = tes.laguerre_tessellation(dtf[['x', 'y', 'z']].values,
+                                     dtf['d'].values / 2)
+    size = 200**(-1 / 3)
+    min_edge = 0.02 * size
+    assert tes.validate_tessellation(tess, min_edge=min_edge)['short_edges']
+    reg = tes.regularize(tess, min_edge, 0.001 * size**2)
+    report = tes.validate_tessellation(reg, min_edge=min_edge)
+    assert report['nonplanar_faces'] == 0
+    assert report['short_edges'] == 0
+    assert report['empty_cells'] == 0
+    assert not any(report[key] for key in tes.VALIDATION_PROBLEMS)
+    assert len(reg['edge']) < len(tess['edge'])
@@ -0,0 +1,28 @@
+"""Tests of :mod:`foamgen.vtk_tools`."""
+import numpy as np
+from foamgen import vtk_tools as vt
+from foamgen import tessellation as tes
+
+
+def area(corners):
+    """Compute total area of triangles."""
+    return np.sum(np.linalg.norm(np.cross(
+        corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]),
+        axis=1)) / 2
+
+
+def test_stl_to_periodic_box(tmp_path):
+    rng = np.random.default_rng(0)
+    domain = 2.0
+    tess = tes.laguerre_tessellation(rng.random((30, 3)) * domain,
+                                     rng.uniform(0.1, 0.3, 30), domain)
+    corners = tess['vertex'][tes.triangulate(tess)]
+    # cells are not cut by the domain boundary
+    assert np.any(corners < 0) and np.any(corners > domain)
+    fin, fout = str(tmp_path / 'in.stl'), str(tmp_path / 'out.stl')
+    points, triangles = vt.merge_points(corners)
+    vt.save_stl(fin, points, triangles)
+    vt.stl_to_periodic_box(fin, fout, [0, 0, 0], [domain] * 3, False)
+    boxed = vt.read_stl(fout)
+    assert np.all(boxed >= -1e-6) and np.all(boxed <= domain + 1e-6)
+    assert np.isclose(area(boxed), area(corners), rtol=1e-5)